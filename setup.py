@@ -146,7 +146,7 @@ version = '0.2.1'
 setup(
     name='MoNK',
     package_dir={'': 'src'},
-    py_modules=['svg2modelica'],
+    py_modules=['svg2modelica', 'svg2modelica_client'],
     version=version,
     platforms="any",
     license="MIT",
@@ -176,7 +176,8 @@ setup(
         'lxml',
         'numpy==1.16.4; python_version < "3.0.0"',
         'numpy; python_version >= "3.6.0"',
-        'pathlib; python_version < "3.3.0"'  # for python < 3.3
+        'pathlib; python_version < "3.3.0"',  # for python < 3.3
+        'futures; python_version < "3.0.0"'  # for batch mode in python 2
     ],
     cmdclass={
         'install_ink': InstallToExtensionDir,
@@ -1,17 +1,34 @@
 # -*- coding: utf-8 -*-
 
+import colorsys
+import contextlib
+import copy
 import getopt
+import glob
+import hashlib
+import json
+import math
+import os
 import sys
 import lxml.etree as etree
 import re
-import numpy as np
+from collections import OrderedDict
 
-inkex_available = True
+__version__ = "0.2.1"
 
-try:
-    import inkex
-except ImportError:
-    inkex_available = False
+# NOTE: numpy is not imported here on purpose, since the import takes longer
+# than the whole conversion of a typical icon. 3x3 matrices are represented
+# as nested tuples of floats and numpy is only imported by lazy_numpy() for
+# operations on large batches of data.
+np = None
+
+
+def lazy_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
 
 
 def identity(x):
@@ -22,14 +39,142 @@ def nonzero(x):
     return abs(x) > 1e-10
 
 
+def isclose(a, b, rtol=1e-5, atol=1e-8):
+    # same semantics as numpy.isclose for scalars
+    return abs(a - b) <= atol + rtol * abs(b)
+
+
+def sign(x):
+    return (x > 0) - (x < 0)
+
+
 class MoNKError(Exception):
     def __init__(self, msg):
         self.msg = msg
 
 
+class Affine(object):
+    # 2D affine transformation with the same parameters as the SVG transform
+    # function matrix(a, b, c, d, e, f), which stands for the 3x3 matrix
+    # a   c   e
+    # b   d   f
+    # 0   0   1
+    __slots__ = ("a", "b", "c", "d", "e", "f")
+
+    def __init__(self, a=1.0, b=0.0, c=0.0, d=1.0, e=0.0, f=0.0):
+        self.a = a
+        self.b = b
+        self.c = c
+        self.d = d
+        self.e = e
+        self.f = f
+
+    def compose(self, other):
+        # matrix product self * other (other is applied first)
+        return Affine(
+            self.a * other.a + self.c * other.b,
+            self.b * other.a + self.d * other.b,
+            self.a * other.c + self.c * other.d,
+            self.b * other.c + self.d * other.d,
+            self.a * other.e + self.c * other.f + self.e,
+            self.b * other.e + self.d * other.f + self.f
+        )
+
+    def invert(self):
+        det = self.a * self.d - self.b * self.c
+        if det == 0:
+            raise MoNKError("transformation {} is not invertible".format(self))
+        return Affine(
+            self.d / det, -self.b / det, -self.c / det, self.a / det,
+            (self.c * self.f - self.d * self.e) / det,
+            (self.b * self.e - self.a * self.f) / det
+        )
+
+    def apply(self, x, y):
+        return (
+            self.a * x + self.c * y + self.e,
+            self.b * x + self.d * y + self.f
+        )
+
+    def decompose(self, strict=False):
+        # decompose transformation matrix to angle + origin form
+        # we assume that the matrix has the following form
+        # sx * cos(alpha)   -sy * sin(alpha)   tx
+        # sx * sin(alpha)    sy * cos(alpha)   ty
+        #      0                   0            1
+        # 1. Get translation
+        tx = self.e
+        ty = self.f
+        # 2. Get scaling (since sin²(x) + cos²(x) = 1)
+        sx = math.sqrt(self.a ** 2 + self.b ** 2)
+        sy = math.sqrt(self.c ** 2 + self.d ** 2)
+        # sign for scaling is ambiguous due to symmetries in trigonometric
+        # functions (sin(-x) = -sin(x) and cos(-x) = cos(x))
+        # therefore we only look for the sign of the diagonal and arbitrarily
+        # flip one of the axes if required
+        if not nonzero(self.b):
+            flipped = sign(self.a) != sign(self.d)
+        else:
+            flipped = sign(self.b) == sign(self.c)
+        if flipped:
+            sx *= -1
+        # 3. Remove scaling and obtain rotational angle (from the y axis if
+        # the x axis is scaled to nothing, which also gives 0 if both are)
+        if sx != 0:
+            alpha = math.atan2(self.b / sx, self.a / sx)
+        else:
+            alpha = math.atan2(-self.c, self.d)
+        if strict:
+            # check that decomposed matrix equals the original matrix
+            ref = Affine(
+                sx * math.cos(alpha), sx * math.sin(alpha),
+                sy * -math.sin(alpha), sy * math.cos(alpha), tx, ty
+            )
+            if not all(
+                isclose(m, r, rtol=1e-4, atol=1e-3)
+                for m, r in zip(self.to_tuple(), ref.to_tuple())
+            ):
+                raise MoNKError("".join([
+                    "Transformation matrix is not reducible to angle + ",
+                    "origin [+ scaling] form.\n\n",
+                    "{0}\n!=\n{1}"
+                ]).format(self, ref))
+        return tx, ty, sx, sy, alpha
+
+    def to_tuple(self):
+        return (self.a, self.b, self.c, self.d, self.e, self.f)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Affine) and self.to_tuple() == other.to_tuple()
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.to_tuple())
+
+    def __repr__(self):
+        return "Affine({!r}, {!r}, {!r}, {!r}, {!r}, {!r})".format(
+            *self.to_tuple()
+        )
+
+
+IDENTITY = Affine()
+# flips the y axis
+FLIP = Affine(d=-1.0)
+
+
 INDENT = "    "
 
 re_to_f = re.compile(r"(\-?\d+(?:\.\d+)?(?:e\-?\d+)?)[^\d]*")
+re_ws = re.compile(r"\s+")
+re_closed_path = re.compile(r".*[zZ]\s*$")
+re_path_command = re.compile(
+    r"([MmZzLlHhVvCcSsQqTtAa])([^MmZzLlHhVvCcSsQqTtAa]*)"
+)
+re_size = re.compile(r"(-?\d+\.?\d*)([a-zA-Z]*)")
 
 
 def to_f(s):
@@ -37,47 +182,927 @@ def to_f(s):
 
 
 def to_s(*args, **kwargs):
-    decimal_place = kwargs.get("decimal_place", 2)
+    fmt, zeros = number_format(kwargs.get("decimal_place", 2))
     res = []
     for f in args:
-        s = ("%."+str(decimal_place)+"f") % f
-        if (s[-decimal_place:] == "0"*decimal_place):
-            s = s[:-decimal_place-1]
+        s = fmt % f
+        if zeros is not None and s.endswith(zeros):
+            s = s[:-len(zeros)]
         res.append(s)
     if len(res) == 1:
         return res[0]
     return tuple(res)
 
 
+# format string and trailing zeros (that are removed by to_s) per number of
+# decimal places
+number_formats = {}
+
+
+def number_format(decimal_place):
+    res = number_formats.get(decimal_place)
+    if res is None:
+        zeros = "." + "0" * decimal_place if decimal_place > 0 else None
+        res = ("%." + str(decimal_place) + "f", zeros)
+        number_formats[decimal_place] = res
+    return res
+
+
+# regular expressions matching the trailing zeros that to_s removes
+trailing_zeros = {}
+
+
+def format_numbers(template, values, decimal_place=2):
+    # replaces each "%s" in template by the corresponding value formatted
+    # like to_s in a single formatting operation
+    # template must not contain digits besides the placeholders
+    fmt, zeros = number_format(decimal_place)
+    res = template.replace("%s", fmt) % tuple(values)
+    if zeros is None:
+        return res
+    regex = trailing_zeros.get(decimal_place)
+    if regex is None:
+        regex = re.compile(re.escape(zeros) + r"(?!\d)")
+        trailing_zeros[decimal_place] = regex
+    return regex.sub("", res)
+
+
+def format_points(points, decimal_place=2):
+    # formats a sequence of (x, y) pairs as Modelica array of points
+    values = [v for p in points for v in p]
+    template = "{%s}" % ", ".join(["{%s, %s}"] * (len(values) // 2))
+    return format_numbers(template, values, decimal_place)
+
+
+def format_point_buffer(points, offsets, decimal_place=2):
+    # formats the paths in an (N, 2) array of points (see
+    # quantize_point_buffer) with format_points in one operation
+    counts = [j - i for i, j in zip(offsets[:-1], offsets[1:])]
+    template = "\n".join(
+        "{%s}" % ", ".join(["{%s, %s}"] * n) for n in counts
+    )
+    return format_numbers(
+        template, points.ravel().tolist(), decimal_place
+    ).split("\n")
+
+
 def tn(el):
     return etree.QName(el.tag).localname
 
 
+# tags whose subtrees never contribute to the Modelica output
+IGNORED_TAGS = frozenset(["defs", "metadata", "namedview", "style", "symbol"])
+# attribute of <use> elements that references the instantiated element (SVG 2
+# uses a plain href attribute instead)
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+
 def parse_svg(
         fname, modelname, strict=False, normalize_extent=False,
-        text_extent="normal"
+        text_extent="normal", streaming=False, cache=None,
+        element_cache=None, simplify=0, flatten_tolerance=0.1,
+        point_budget=1000, compact=False, output=None, jobs=1
 ):
+    # writes the Modelica model to the file output (default: stdout)
+    options = dict(
+        strict=strict, normalize_extent=normalize_extent,
+        text_extent=text_extent, streaming=streaming,
+        element_cache=element_cache, simplify=simplify,
+        flatten_tolerance=flatten_tolerance, point_budget=point_budget,
+        compact=compact, jobs=jobs
+    )
+    with open_output(output) as out:
+        if cache is not None:
+            out.write(convert_svg(fname, modelname, cache=cache, **options))
+        else:
+            write_svg(out, fname, modelname, **options)
+        out.write("\n")
+
+
+def convert_svg(
+        fname, modelname, strict=False, normalize_extent=False,
+        text_extent="normal", streaming=False, cache=None,
+        element_cache=None, simplify=0, flatten_tolerance=0.1,
+        point_budget=1000, compact=False, jobs=1
+):
+    if cache is not None:
+        # parallel conversion does not change the result and is therefore
+        # not part of the cache key, but streaming does (<use> elements are
+        # skipped and <style> rules only apply to the elements after them)
+        key = cache.key(fname, {
+            "modelname": modelname, "strict": strict,
+            "normalize_extent": normalize_extent, "text_extent": text_extent,
+            "streaming": streaming, "simplify": simplify,
+            "flatten_tolerance": flatten_tolerance,
+            "point_budget": point_budget, "compact": compact
+        })
+        res = cache.get(key)
+        if res is None:
+            res = convert_svg(
+                fname, modelname, strict=strict,
+                normalize_extent=normalize_extent, text_extent=text_extent,
+                streaming=streaming, element_cache=element_cache,
+                simplify=simplify, flatten_tolerance=flatten_tolerance,
+                point_budget=point_budget, compact=compact, jobs=jobs
+            )
+            cache.put(key, res)
+        return res
+    out = StringWriter()
+    write_svg(
+        out, fname, modelname, strict=strict,
+        normalize_extent=normalize_extent, text_extent=text_extent,
+        streaming=streaming, element_cache=element_cache, simplify=simplify,
+        flatten_tolerance=flatten_tolerance, point_budget=point_budget,
+        compact=compact, jobs=jobs
+    )
+    return out.getvalue()
+
+
+def write_svg(
+        out, fname, modelname, strict=False, normalize_extent=False,
+        text_extent="normal", streaming=False, element_cache=None,
+        simplify=0, flatten_tolerance=0.1, point_budget=1000, compact=False,
+        jobs=1
+):
+    # writes the Modelica model for the SVG file fname to the sink out
+    # in streaming mode, the graphic elements are converted while they are
+    # written, so that only a chunk of them is held in memory at once
+    # otherwise, large documents are converted by jobs worker processes
+    if compact:
+        out = CompactWriter(out)
+    interned_values.clear()
     with open(fname, "rb") as f:
-        parser = etree.XMLParser(encoding="utf-8", ns_clean=True)
-        document = etree.parse(f, parser=parser)
-    res = "model {1}\n" \
-        + "{0}annotation(\n" \
-        + "{0}{0}{2}\n" \
-        + "{0});\n" \
-        + "end {1};"
-    main_icon = ModelicaIcon(
-        document, normalize_extent=normalize_extent, strict=strict,
-        text_extent=text_extent
+        if streaming:
+            document = SvgStream(f)
+        else:
+            parser = etree.XMLParser(encoding="utf-8", ns_clean=True)
+            document = etree.parse(f, parser=parser)
+        main_icon = ModelicaIcon(
+            document, normalize_extent=normalize_extent, strict=strict,
+            text_extent=text_extent, element_cache=element_cache,
+            simplify=simplify, flatten_tolerance=flatten_tolerance,
+            point_budget=point_budget, compact=compact, jobs=jobs
+        )
+        out.write("model {1}\n{0}annotation(\n{0}{0}".format(
+            INDENT, modelname
+        ))
+        main_icon.write(out)
+        out.write("\n{0});\nend {1};".format(INDENT, modelname))
+    if simplify > 0:
+        # elements taken from the element cache are not counted
+        sys.stderr.write(
+            "simplified lines and polygons from {} to {} points\n".format(
+                *main_icon.graphics.point_counts
+            )
+        )
+
+
+class LRUCache(object):
+    # bounded mapping that forgets the least recently used entries
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            return default
+        self.data[key] = value
+        return value
+
+    def put(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        if len(self.data) > self.max_entries:
+            self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ElementCache(LRUCache):
+    # memo of Modelica strings for single SVG elements, which allows to only
+    # convert the elements that changed since the last conversion
+    def __init__(self, max_entries=20000):
+        LRUCache.__init__(self, max_entries)
+        self.modified = False
+
+    def put(self, key, value):
+        LRUCache.put(self, key, value)
+        self.modified = True
+
+    def load(self, fname):
+        # the file is a json list of [hex digest, Modelica code] pairs; json
+        # instead of pickle, since the cache directory may be shared and
+        # unpickling a manipulated file would execute arbitrary code
+        try:
+            with open(fname, "rb") as f:
+                entries = json.loads(f.read().decode("utf-8"))
+            text = type(u"")
+            if not isinstance(entries, list) or not all(
+                isinstance(e, list) and len(e) == 2
+                and isinstance(e[0], text) and isinstance(e[1], text)
+                for e in entries
+            ):
+                return self  # malformed file, start with an empty cache
+        except (IOError, OSError, ValueError):
+            return self  # start with an empty cache
+        for k, v in entries:
+            LRUCache.put(self, k, v)
+        return self
+
+    def save(self, fname):
+        if not self.modified:
+            return
+        data = json.dumps(
+            [[k, v] for k, v in self.data.items()], separators=(",", ":")
+        ).encode("utf-8")
+        # write to a temporary file first, so that other processes never see
+        # an incomplete cache
+        tmp = "{}.{}.tmp".format(fname, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(data)
+        try:
+            os.rename(tmp, fname)
+        except OSError:
+            # rename does not replace existing files on windows
+            os.remove(fname)
+            os.rename(tmp, fname)
+        self.modified = False
+
+
+class CachedElement(object):
+    # element that was taken from an ElementCache
+    __slots__ = ("s",)
+
+    def __init__(self, s):
+        self.s = s
+
+    def __str__(self):
+        return self.s
+
+    def write(self, out):
+        out.write(self.s)
+
+
+class StringWriter(object):
+    # sink for the write methods of Modelica elements that collects the
+    # fragments in memory
+    compact = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, s):
+        self.parts.append(s)
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+class Utf8Writer(object):
+    # buffered sink that writes the fragments to a binary file as UTF-8
+    compact = False
+
+    def __init__(self, f, buffer_size=1 << 16):
+        self.f = f
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, s):
+        self.parts.append(s)
+        self.size += len(s)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        data = "".join(self.parts)
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        self.f.write(data)
+        self.f.flush()
+        self.parts = []
+        self.size = 0
+
+
+class CompactWriter(object):
+    # sink that passes the fragments to out with all optional whitespace and
+    # redundant digits removed; elements written to it also leave out
+    # attributes that have their default value
+    compact = True
+
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, s):
+        self.out.write(compact_code(s))
+
+
+re_compact = re.compile(
+    # string literals, numbers, whitespace between names, other whitespace
+    r'("(?:[^"\\]|\\.)*")|(?<![\w.])(-?)(\d+)(?:\.(\d+))?(?![\w.])'
+    r'|(?<=\w)(\s+)(?=\w)|\s+'
+)
+
+
+def compact_number(sign, integer, fraction):
+    # shortest exact representation of a number given by its digits
+    fraction = (fraction or "").rstrip("0")
+    if fraction:
+        return sign + integer + "." + fraction
+    if integer.strip("0") == "":
+        return "0"
+    zeros = len(integer) - len(integer.rstrip("0"))
+    if zeros >= 3:
+        integer = integer.rstrip("0") + "e" + str(zeros)
+    return sign + integer
+
+
+def compact_match(m):
+    if m.group(1) is not None:
+        return m.group(1)
+    if m.group(3) is not None:
+        return compact_number(m.group(2), m.group(3), m.group(4))
+    if m.group(5) is not None:
+        return " "
+    return ""
+
+
+def compact_code(s):
+    return re_compact.sub(compact_match, s)
+
+
+@contextlib.contextmanager
+def open_output(fname=None):
+    # yields a Utf8Writer for stdout or for the file fname, which is only
+    # replaced once the output is complete
+    if fname is None:
+        out = Utf8Writer(getattr(sys.stdout, "buffer", sys.stdout))
+        yield out
+        out.flush()
+        return
+    tmp = "{}.{}.tmp".format(fname, os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            out = Utf8Writer(f)
+            yield out
+            out.flush()
+        if os.path.exists(fname):
+            os.remove(fname)
+        os.rename(tmp, fname)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class ConversionCache(object):
+    # content-addressed on-disk cache of conversion results; entries are
+    # evicted in least recently used order when the total size exceeds
+    # max_size bytes
+    def __init__(self, directory, max_size=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.size_estimate = None
+
+    def key(self, fname, options):
+        h = hashlib.sha256()
+        h.update(json.dumps(
+            [__version__, sorted(options.items())]
+        ).encode("utf-8"))
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".mo")
+
+    def element_cache_path(self):
+        return os.path.join(self.directory, "elements.json")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                res = f.read().decode("utf-8")
+            # the modification time marks the last use for eviction
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return res
+
+    def put(self, key, result):
+        path = self.path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass  # created concurrently by another process
+        data = result.encode("utf-8")
+        # write to a temporary file first, so that other processes never see
+        # incomplete entries
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(data)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # entry already exists on windows (with the same content)
+            os.remove(tmp)
+        if self.size_estimate is None:
+            self.size_estimate = sum(s for _, s, _ in self.entries())
+        else:
+            self.size_estimate += len(data)
+        if self.size_estimate > self.max_size:
+            self.evict()
+
+    def entries(self):
+        # returns a list of (path, size, mtime) tuples for all entries
+        res = []
+        if not os.path.isdir(self.directory):
+            return res
+        for dirpath, _, fnames in os.walk(self.directory):
+            for f in fnames:
+                if not f.endswith(".mo"):
+                    continue
+                path = os.path.join(dirpath, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # evicted concurrently
+                res.append((path, st.st_size, st.st_mtime))
+        return res
+
+    def evict(self):
+        # remove least recently used entries until the cache is at 90% of its
+        # maximum size, so that we do not have to evict on every put
+        entries = sorted(self.entries(), key=lambda x: x[2])
+        total = sum(s for _, s, _ in entries)
+        for path, size, _ in entries:
+            if total <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.size_estimate = total
+
+    def clear(self):
+        paths = [p for p, _, _ in self.entries()]
+        for path in paths + [self.element_cache_path()]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.size_estimate = 0
+
+
+def find_svg_files(inputs):
+    # expand directories (recursively) and glob patterns to a sorted list of
+    # SVG files without duplicates
+    found = set()
+    for inp in inputs:
+        if os.path.isdir(inp):
+            for dirpath, _, fnames in os.walk(inp):
+                found.update(
+                    os.path.join(dirpath, f) for f in fnames
+                    if f.lower().endswith(".svg")
+                )
+        else:
+            found.update(f for f in glob.glob(inp) if os.path.isfile(f))
+    return sorted(found)
+
+
+def model_name(fname):
+    # turns the base name of fname into a valid Modelica identifier
+    base = os.path.splitext(os.path.basename(fname))[0]
+    name = re.sub(r"[^A-Za-z0-9_]", "_", base)
+    if not re.match(r"[A-Za-z_]", name):
+        name = "_" + name
+    return name
+
+
+def output_names(fnames, outdir=None):
+    # returns the .mo file with the same base name for each SVG file, which
+    # is placed next to it or, if outdir is given, in the same relative
+    # directory below outdir as below the common directory of all files, so
+    # that files with the same name in different directories do not
+    # overwrite each other
+    if outdir is None:
+        return [os.path.splitext(f)[0] + ".mo" for f in fnames]
+    dirs = [os.path.abspath(os.path.dirname(f)).split(os.sep) for f in fnames]
+    root = os.sep.join(os.path.commonprefix(dirs)) or os.sep
+    return [
+        os.path.join(outdir, os.path.splitext(
+            os.path.relpath(os.path.abspath(f), root)
+        )[0] + ".mo")
+        for f in fnames
+    ]
+
+
+def convert_file(fname, outname, **options):
+    # converts a single file in batch mode and writes the result to outname;
+    # returns an error message or None
+    try:
+        parse_svg(fname, model_name(fname), output=outname, **options)
+    except MoNKError as e:
+        return e.msg
+    except Exception as e:
+        return "{}: {}".format(type(e).__name__, e)
+    return None
+
+
+def batch_convert(inputs, outdir=None, jobs=None, **options):
+    # converts all SVG files found in inputs in parallel using jobs worker
+    # processes (default: number of CPUs); returns the number of files found
+    # and the errors as list of (filename, message) tuples
+    fnames = find_svg_files(inputs)
+    outnames = output_names(fnames, outdir)
+    for d in set(os.path.dirname(f) for f in outnames):
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+    if jobs is None:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1 or len(fnames) <= 1:
+        results = [
+            convert_file(f, o, **options) for f, o in zip(fnames, outnames)
+        ]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(convert_file, f, o, **options)
+                for f, o in zip(fnames, outnames)
+            ]
+            results = []
+            for fut in futures:
+                err = fut.exception()
+                if err is not None:
+                    # the worker itself died, not just the conversion
+                    results.append("{}: {}".format(type(err).__name__, err))
+                else:
+                    results.append(fut.result())
+    errors = [(f, e) for f, e in zip(fnames, results) if e is not None]
+    return len(fnames), errors
+
+
+class SvgStream(object):
+    # stand-in for an lxml document that is read incrementally with
+    # etree.iterparse: only the root element is available right away, all
+    # other elements are consumed from self.events by the graphics container
+    def __init__(self, f):
+        self.events = etree.iterparse(
+            f, events=("start", "end"), encoding="utf-8",
+            remove_comments=True, remove_pis=True, huge_tree=True
+        )
+        _, self.root = next(self.events)
+
+    def getroot(self):
+        return self.root
+
+
+def free_element(el):
+    # release a fully processed element together with its previous siblings
+    # (which have been processed before) to keep memory usage flat when
+    # streaming large documents
+    el.clear()
+    parent = el.getparent()
+    if parent is None:
+        return
+    while el.getprevious() is not None:
+        del parent[0]
+
+
+# css properties that can also be given as attributes of an element
+PRESENTATION_ATTRIBUTES = frozenset([
+    "color", "display", "fill", "fill-opacity", "fill-rule", "font-family",
+    "font-size", "font-style", "font-weight", "marker-end", "marker-mid",
+    "marker-start", "opacity", "stroke", "stroke-dasharray",
+    "stroke-dashoffset", "stroke-linecap", "stroke-linejoin",
+    "stroke-opacity", "stroke-width", "text-anchor", "text-decoration",
+    "visibility"
+])
+# css properties that elements take over from their parent
+INHERITED_PROPERTIES = frozenset([
+    "color", "fill", "fill-opacity", "fill-rule", "font-family", "font-size",
+    "font-style", "font-weight", "marker-end", "marker-mid", "marker-start",
+    "stroke", "stroke-dasharray", "stroke-dashoffset", "stroke-linecap",
+    "stroke-linejoin", "stroke-opacity", "stroke-width", "text-align",
+    "text-anchor", "visibility"
+])
+EMPTY_STYLE = {}
+style_cache = LRUCache(4096)
+
+
+def parse_style(style):
+    # returns the properties of a style attribute as dictionary, which must
+    # not be modified, since it is shared by all elements with this style
+    if style is None:
+        return EMPTY_STYLE
+    res = style_cache.get(style)
+    if res is None:
+        res = {}
+        for decl in style.split(";"):
+            name, sep, value = decl.partition(":")
+            if sep:
+                res[name.strip()] = value.strip()
+        style_cache.put(style, res)
+    return res
+
+
+def computed_style(el, inherited=None, stylesheet=None):
+    # returns the css properties of el given by presentation attributes, the
+    # rules of the stylesheet, the style attribute and !important rules (in
+    # increasing order of precedence) and the properties inherited from the
+    # parent (determined from the ancestors of el if not given)
+    if inherited is None:
+        parent = el.getparent()
+        if parent is None:
+            inherited = EMPTY_STYLE
+        else:
+            inherited = inherited_style(
+                computed_style(parent, stylesheet=stylesheet)
+            )
+    own = parse_style(el.get("style"))
+    matched, important = NO_MATCH if stylesheet is None \
+        else stylesheet.match(el)
+    presentation = PRESENTATION_ATTRIBUTES.intersection(el.keys())
+    if not inherited and not presentation and not matched \
+            and not important and "inherit" not in own.values():
+        return own
+    res = dict(inherited)
+    for name in presentation:
+        res[name] = el.get(name)
+    res.update(matched)
+    res.update(own)
+    res.update(important)
+    for name, value in list(res.items()):
+        if value == "inherit":
+            if name in inherited:
+                res[name] = inherited[name]
+            else:
+                del res[name]
+    return res
+
+
+def inherited_style(style):
+    # properties of style that are passed on to the children
+    return dict(
+        (k, v) for k, v in style.items()
+        if k in INHERITED_PROPERTIES and v != "inherit"
     )
-    print(res.format(INDENT, modelname, main_icon))
 
 
-def get_style_attribute(el, name):
-    if el.get("style") is None:
-        return None
-    for att in el.get("style").split(";"):
-        if att.startswith(name+":"):
-            return att[len(name)+1:]
+# declarations and !important declarations of the rules that match an
+# element without a stylesheet
+NO_MATCH = (EMPTY_STYLE, EMPTY_STYLE)
+re_css_comment = re.compile(r"/\*.*?\*/", re.DOTALL)
+re_css_selector = re.compile(r"([a-zA-Z][\w-]*|\*)?((?:[.#][\w-]+)*)$")
+re_css_selector_part = re.compile(r"([.#])([\w-]+)")
+re_css_important = re.compile(r"\s*!\s*important$", re.IGNORECASE)
+
+
+class Stylesheet(object):
+    # css rules of the <style> elements of a document; rules are indexed by
+    # an id ("#id"), class (".class") or tag name that matching elements must
+    # have, so that the rules of an element are found with a few lookups
+    # NOT SUPPORTED (svg): combinators, attribute selectors, pseudo-classes
+    def __init__(self, strict=False):
+        self.strict = strict
+        self.index = {}
+        self.n_rules = 0
+        # identifies the rules for the element cache
+        self.key = ""
+        # matched declarations per tag, id (only if there are rules for it)
+        # and class attribute
+        self.matches = {}
+
+    def add(self, css):
+        if not css:
+            return
+        self.key = hashlib.sha1(
+            (self.key + css).encode("utf-8")
+        ).hexdigest()
+        self.matches = {}
+        for selectors, block in self.parse_rules(css):
+            normal = {}
+            important = {}
+            for name, value in parse_style(block).items():
+                m = re_css_important.search(value)
+                if m is None:
+                    normal[name] = value
+                else:
+                    important[name] = value[:m.start()]
+            for selector in selectors.split(","):
+                self.add_rule(selector.strip(), normal, important)
+
+    def parse_rules(self, css):
+        # yields selectors and declaration block of all rules in css text
+        css = re_css_comment.sub("", css)
+        pos = 0
+        while True:
+            start = css.find("{", pos)
+            if start < 0:
+                return
+            # at-rules without a block like @import end with a semicolon
+            prelude = css[pos:start].rpartition(";")[2].strip()
+            end = css.find("}", start)
+            if end < 0:
+                end = len(css)
+            if prelude.startswith("@"):
+                # NOT SUPPORTED (svg): at-rules like @media or @font-face
+                if self.strict:
+                    raise MoNKError(
+                        "css at-rule {} is not supported".format(prelude)
+                    )
+                # skip nested blocks
+                depth = css.count("{", start + 1, end)
+                while depth > 0 and end < len(css):
+                    nxt = css.find("}", end + 1)
+                    if nxt < 0:
+                        nxt = len(css)
+                    depth += css.count("{", end + 1, nxt) - 1
+                    end = nxt
+            else:
+                yield prelude, css[start + 1:end]
+            pos = end + 1
+
+    def add_rule(self, selector, normal, important):
+        m = re_css_selector.match(selector)
+        if m is None or not selector:
+            if self.strict:
+                raise MoNKError(
+                    "css selector {} is not supported".format(selector)
+                )
+            return
+        tag = m.group(1)
+        if tag == "*":
+            tag = None
+        ids = []
+        classes = []
+        for kind, name in re_css_selector_part.findall(m.group(2)):
+            (ids if kind == "#" else classes).append(name)
+        specificity = (len(ids), len(classes), 0 if tag is None else 1)
+        if ids:
+            key = "#" + ids[0]
+        elif classes:
+            key = "." + classes[0]
+        else:
+            key = tag or "*"
+        self.index.setdefault(key, []).append((
+            specificity, self.n_rules, tag, frozenset(ids),
+            frozenset(classes), normal, important
+        ))
+        self.n_rules += 1
+
+    def match(self, el):
+        # returns the merged declarations and !important declarations of all
+        # rules that match el, applied in the order of their specificity
+        if not self.index:
+            return NO_MATCH
+        tag = tn(el)
+        el_id = el.get("id")
+        if el_id is not None and "#" + el_id not in self.index:
+            # ids are unique, so they are only part of the key if needed
+            el_id = None
+        cls = el.get("class")
+        key = (tag, el_id, cls)
+        res = self.matches.get(key)
+        if res is None:
+            classes = frozenset(cls.split()) if cls else frozenset()
+            ids = frozenset() if el_id is None else frozenset([el_id])
+            keys = [tag, "*"] + ["." + c for c in classes]
+            if el_id is not None:
+                keys.append("#" + el_id)
+            rules = [
+                r for k in keys for r in self.index.get(k, ())
+                if (r[2] is None or r[2] == tag)
+                and r[3] <= ids and r[4] <= classes
+            ]
+            rules.sort(key=lambda r: r[:2])
+            res = ({}, {})
+            for r in rules:
+                res[0].update(r[5])
+                res[1].update(r[6])
+            self.matches[key] = res
+        return res
+
+
+# css color keywords (CSS Color Module Level 4) as hexadecimal strings
+CSS_COLOR_NAMES = """
+aliceblue f0f8ff antiquewhite faebd7 aqua 00ffff aquamarine 7fffd4
+azure f0ffff beige f5f5dc bisque ffe4c4 black 000000 blanchedalmond ffebcd
+blue 0000ff blueviolet 8a2be2 brown a52a2a burlywood deb887
+cadetblue 5f9ea0 chartreuse 7fff00 chocolate d2691e coral ff7f50
+cornflowerblue 6495ed cornsilk fff8dc crimson dc143c cyan 00ffff
+darkblue 00008b darkcyan 008b8b darkgoldenrod b8860b darkgray a9a9a9
+darkgreen 006400 darkgrey a9a9a9 darkkhaki bdb76b darkmagenta 8b008b
+darkolivegreen 556b2f darkorange ff8c00 darkorchid 9932cc darkred 8b0000
+darksalmon e9967a darkseagreen 8fbc8f darkslateblue 483d8b
+darkslategray 2f4f4f darkslategrey 2f4f4f darkturquoise 00ced1
+darkviolet 9400d3 deeppink ff1493 deepskyblue 00bfff dimgray 696969
+dimgrey 696969 dodgerblue 1e90ff firebrick b22222 floralwhite fffaf0
+forestgreen 228b22 fuchsia ff00ff gainsboro dcdcdc ghostwhite f8f8ff
+gold ffd700 goldenrod daa520 gray 808080 green 008000 greenyellow adff2f
+grey 808080 honeydew f0fff0 hotpink ff69b4 indianred cd5c5c indigo 4b0082
+ivory fffff0 khaki f0e68c lavender e6e6fa lavenderblush fff0f5
+lawngreen 7cfc00 lemonchiffon fffacd lightblue add8e6 lightcoral f08080
+lightcyan e0ffff lightgoldenrodyellow fafad2 lightgray d3d3d3
+lightgreen 90ee90 lightgrey d3d3d3 lightpink ffb6c1 lightsalmon ffa07a
+lightseagreen 20b2aa lightskyblue 87cefa lightslategray 778899
+lightslategrey 778899 lightsteelblue b0c4de lightyellow ffffe0
+lime 00ff00 limegreen 32cd32 linen faf0e6 magenta ff00ff maroon 800000
+mediumaquamarine 66cdaa mediumblue 0000cd mediumorchid ba55d3
+mediumpurple 9370db mediumseagreen 3cb371 mediumslateblue 7b68ee
+mediumspringgreen 00fa9a mediumturquoise 48d1cc mediumvioletred c71585
+midnightblue 191970 mintcream f5fffa mistyrose ffe4e1 moccasin ffe4b5
+navajowhite ffdead navy 000080 oldlace fdf5e6 olive 808000
+olivedrab 6b8e23 orange ffa500 orangered ff4500 orchid da70d6
+palegoldenrod eee8aa palegreen 98fb98 paleturquoise afeeee
+palevioletred db7093 papayawhip ffefd5 peachpuff ffdab9 peru cd853f
+pink ffc0cb plum dda0dd powderblue b0e0e6 purple 800080
+rebeccapurple 663399 red ff0000 rosybrown bc8f8f royalblue 4169e1
+saddlebrown 8b4513 salmon fa8072 sandybrown f4a460 seagreen 2e8b57
+seashell fff5ee sienna a0522d silver c0c0c0 skyblue 87ceeb
+slateblue 6a5acd slategray 708090 slategrey 708090 snow fffafa
+springgreen 00ff7f steelblue 4682b4 tan d2b48c teal 008080 thistle d8bfd8
+tomato ff6347 turquoise 40e0d0 violet ee82ee wheat f5deb3 white ffffff
+whitesmoke f5f5f5 yellow ffff00 yellowgreen 9acd32
+"""
+# factors that convert css angle units to degrees
+CSS_ANGLE_UNITS = {
+    "": 1.0, "deg": 1.0, "rad": 180 / math.pi, "grad": 0.9, "turn": 360.0
+}
+# color values that do not paint anything
+CSS_NO_COLOR = frozenset(["none", "transparent"])
+re_css_hex = re.compile(r"#([0-9a-fA-F]{3,4}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})$")
+re_css_function = re.compile(r"(rgba?|hsla?)\(\s*(.*?)\s*\)$")
+re_css_arg = re.compile(
+    r"([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)(%|[a-z]*)$"
+)
+re_css_arg_sep = re.compile(r"\s*[,/]\s*|\s+")
+css_color_names = {}
+color_cache = LRUCache(1024)
+# marks strings in color_cache that are no supported color
+NO_COLOR = ""
+
+
+def css_color_to_modelica(value):
+    # returns the Modelica literal {r,g,b} for a css color value or None if
+    # the value is not a supported color (alpha values are ignored)
+    res = color_cache.get(value)
+    if res is None:
+        rgb = parse_css_color(value.strip())
+        if rgb is None:
+            res = NO_COLOR
+        else:
+            # components are rounded half up after removing floating point
+            # noise (e.g. of hsl conversions), so that 50% becomes 128
+            res = "{%d,%d,%d}" % tuple(
+                min(255, max(0, int(math.floor(round(x, 6) + 0.5))))
+                for x in rgb
+            )
+        color_cache.put(value, res)
+    return res or None
+
+
+def parse_css_color(value):
+    # returns the red, green and blue components of a css color in the range
+    # 0 to 255 (not rounded) or None if the color cannot be parsed
+    m = re_css_hex.match(value)
+    if m is not None:
+        digits = m.group(1)
+        if len(digits) < 6:
+            return [int(x, 16) * 17 for x in digits[:3]]
+        return [int(digits[i:i + 2], 16) for i in range(0, 6, 2)]
+    m = re_css_function.match(value.lower())
+    if m is not None:
+        args = [re_css_arg.match(x) for x in re_css_arg_sep.split(m.group(2))]
+        if len(args) not in (3, 4) or None in args:
+            return None
+        args = [(float(a.group(1)), a.group(2)) for a in args]
+        if m.group(1).startswith("rgb"):
+            if any(u not in ("", "%") for _, u in args[:3]):
+                return None
+            return [x * 255 / 100 if u == "%" else x for x, u in args[:3]]
+        (hue, hu), (sat, su), (light, lu) = args[:3]
+        if hu not in CSS_ANGLE_UNITS or su != "%" or lu != "%":
+            return None
+        hue = hue * CSS_ANGLE_UNITS[hu] / 360.0 % 1.0
+        sat = min(1.0, max(0.0, sat / 100))
+        light = min(1.0, max(0.0, light / 100))
+        return [x * 255 for x in colorsys.hls_to_rgb(hue, light, sat)]
+    if not css_color_names:
+        names = CSS_COLOR_NAMES.split()
+        css_color_names.update(zip(names[::2], names[1::2]))
+    name = css_color_names.get(value.lower())
+    if name is not None:
+        return parse_css_color("#" + name)
     return None
 
 
@@ -94,48 +1119,146 @@ def transform_units(value, from_unit, to_unit):
     return value * to_mm_factors[from_unit] / to_mm_factors[to_unit]
 
 
+# default values of attributes (in the form produced by compact_code), which
+# are left out in compact output
+GRAPHIC_ITEM_DEFAULTS = {"origin": "{0,0}", "rotation": "0"}
+FILLED_SHAPE_DEFAULTS = dict(GRAPHIC_ITEM_DEFAULTS, **{
+    "lineColor": "{0,0,0}", "fillColor": "{0,0,0}",
+    "pattern": "LinePattern.Solid", "fillPattern": "FillPattern.None",
+    "lineThickness": "0.25"
+})
+MODELICA_DEFAULTS = {
+    "coordinateSystem": {
+        "extent": "{{-100,-100},{100,100}}", "preserveAspectRatio": "true",
+        "initialScale": "0.1"
+    },
+    "Line": dict(GRAPHIC_ITEM_DEFAULTS, **{
+        "color": "{0,0,0}", "pattern": "LinePattern.Solid",
+        "thickness": "0.25", "arrow": "{Arrow.None,Arrow.None}",
+        "arrowSize": "3", "smooth": "Smooth.None"
+    }),
+    "Polygon": dict(FILLED_SHAPE_DEFAULTS, smooth="Smooth.None"),
+    "Rectangle": dict(
+        FILLED_SHAPE_DEFAULTS, borderPattern="BorderPattern.None", radius="0"
+    ),
+    "Ellipse": dict(FILLED_SHAPE_DEFAULTS, startAngle="0", endAngle="360"),
+    "Text": dict(FILLED_SHAPE_DEFAULTS, **{
+        "fontSize": "0", "fontName": '""', "textStyle": "{}",
+        "horizontalAlignment": "TextAlignment.Center"
+    })
+}
+
+
+# attributes whose values are usually shared by many elements (colors and
+# enum values) are interned, so that each distinct value is stored only once;
+# the interned values are forgotten at the start of each document, so that a
+# long running daemon does not accumulate them
+INTERNED_FIELDS = frozenset([
+    "arrow", "borderPattern", "color", "fillColor", "fillPattern",
+    "horizontalAlignment", "lineColor", "pattern", "smooth", "textColor",
+    "textStyle"
+])
+interned_values = {}
+
+
+def record_fields(*names):
+    # returns the Modelica attributes of an element class in the order in
+    # which they are written and the position of each attribute
+    names = tuple(sorted(names))
+    return names, dict((name, i) for i, name in enumerate(names))
+
+
 class ModelicaElement(object):
+    # the attribute values are stored in a list with one entry per field
+    # (None if the attribute is not set)
+    FIELDS, FIELD_INDEX = record_fields()
+    # instance attributes for the __slots__ of the primitives (the mixin
+    # classes have no instance attributes besides those of GraphicItem)
+    SLOTS = ("name", "values", "elems", "n_indent")
+    __slots__ = ()
+    # true for elements without children whose attribute values are all
+    # strings or numbers, which can be written in one piece
+    PLAIN_VALUES = False
+
     def __init__(self, name, el, n_indent=3, coords=None, strict=False):
         self.name = name
-        self.data = {}
-        self.elems = []
+        self.values = [None] * len(self.FIELDS)
+        self.elems = ()
         self.n_indent = n_indent
         self.strict = strict
         self.add_attributes(el)
 
     def add_attribute(self, key, value):
-        self.data[key] = value
+        if key in INTERNED_FIELDS:
+            value = interned_values.setdefault(value, value)
+        self.values[self.FIELD_INDEX[key]] = value
+
+    def get_attribute(self, key):
+        return self.values[self.FIELD_INDEX[key]]
+
+    def remove_attribute(self, key):
+        self.values[self.FIELD_INDEX[key]] = None
 
     def add_element(self, modelica_el):
-        self.elems.append(modelica_el)
+        self.elems += (modelica_el,)
 
     def add_attributes(self, el):
         pass
 
     def __str__(self):
+        out = StringWriter()
+        self.write(out)
+        return out.getvalue()
+
+    def write(self, out):
+        # writes the Modelica code of the element to out fragment by
+        # fragment, so that no intermediate strings of the children are built
         line_delim = "\n"+INDENT*self.n_indent
-        inner = line_delim
+        attribs = [
+            (k, v) for k, v in zip(self.FIELDS, self.values) if v is not None
+        ]
+        if out.compact:
+            defaults = MODELICA_DEFAULTS.get(self.name, {})
+            attribs = [
+                (k, v) for k, v in attribs
+                if k not in defaults or hasattr(v, "write")
+                or compact_code("{0}".format(v)) != defaults[k]
+            ]
+        if self.PLAIN_VALUES:
+            # primitives are written at once
+            out.write(
+                self.name + "(" + line_delim
+                + (","+line_delim).join(["%s= %s" % kv for kv in attribs])
+                + "\n" + INDENT*(self.n_indent-1) + ")"
+            )
+            return
+        out.write(self.name + "(" + line_delim)
+        for i, x in enumerate(self.elems):
+            if i > 0:
+                out.write(","+line_delim)
+            x.write(out)
         if len(self.elems) > 0:
-            inner += (","+line_delim).join([str(x) for x in self.elems])
-            if len(self.data) > 0:
-                inner += ","
-            inner += line_delim
-        attribs = sorted(self.data.items(), key=lambda x: x[0])
-        inner += (","+line_delim).join([
-                "{0}= {1}".format(k, v) for k, v in attribs
-        ])
-        inner += "\n"+INDENT*(self.n_indent-1)
-        res = "{0}({1})".format(self.name, inner)
-        return res
+            if len(attribs) > 0:
+                out.write(",")
+            out.write(line_delim)
+        for i, (k, v) in enumerate(attribs):
+            if i > 0:
+                out.write(","+line_delim)
+            out.write("{0}= ".format(k))
+            if hasattr(v, "write"):
+                v.write(out)
+            else:
+                out.write("{0}".format(v))
+        out.write("\n"+INDENT*(self.n_indent-1) + ")")
 
     def check_unsupported_css(self, el, key, default):
         if not self.strict:
             return  # skip check
-        val = get_style_attribute(el, key)
+        val = self.get_style(el).get(key)
         if val is None:
             return
         if isinstance(default, (int, float)):
-            isdefault = np.isclose(float(val), default)
+            isdefault = isclose(float(val), default)
         else:
             isdefault = val == default
         if not isdefault:
@@ -143,13 +1266,24 @@ class ModelicaElement(object):
 
 
 class ModelicaIcon(ModelicaElement):
+    FIELDS, FIELD_INDEX = record_fields("graphics")
+
     def __init__(
             self, doc, n_indent=3, normalize_extent=False, coords=None,
-            strict=False, text_extent="normal"
+            strict=False, text_extent="normal", element_cache=None,
+            simplify=0, flatten_tolerance=0.1, point_budget=1000,
+            compact=False, jobs=1
     ):
         # needs to be initialized first, because add_attribute is called in
         # superclass constructor
         self.norm_extent = normalize_extent
+        self.text_extent = text_extent
+        self.element_cache = element_cache
+        self.simplify = simplify
+        self.flatten_tolerance = flatten_tolerance
+        self.point_budget = point_budget
+        self.compact = compact
+        self.jobs = jobs
         ModelicaElement.__init__(
             self, "Icon", doc, n_indent, coords=coords, strict=strict
         )
@@ -160,16 +1294,20 @@ class ModelicaIcon(ModelicaElement):
             normalize_extent=self.norm_extent
         )
         self.add_element(coords)
-        self.add_attribute(
-            "graphics",
-            ModelicaGraphicsContainer(
-                doc, n_indent=self.n_indent+1, coords=coords,
-                strict=self.strict, text_extent=text_extent
-            )
+        self.graphics = ModelicaGraphicsContainer(
+            doc, n_indent=self.n_indent+1, coords=coords,
+            strict=self.strict, text_extent=self.text_extent,
+            element_cache=self.element_cache, simplify=self.simplify,
+            flatten_tolerance=self.flatten_tolerance,
+            point_budget=self.point_budget, compact=self.compact,
+            jobs=self.jobs
         )
+        self.add_attribute("graphics", self.graphics)
 
 
 class ModelicaCoordinateSystem(ModelicaElement):
+    FIELDS, FIELD_INDEX = record_fields("extent", "preserveAspectRatio")
+
     def __init__(self, svg, n_indent=4, normalize_extent=False, strict=False):
         # needs to be set first to be available in add_attributes
         self.norm_extent = normalize_extent
@@ -180,16 +1318,13 @@ class ModelicaCoordinateSystem(ModelicaElement):
         self.px2mm_factor_y = 1
 
     def normalize_x(self, x):
-        if self.norm_extent:
-            return (x - self.x_center) * self.scale
-        else:
-            return x
+        return self.normalization.apply(x, 0)[0]
 
     def normalize_y(self, y):
-        if self.norm_extent:
-            return (y - self.y_center) * self.scale
-        else:
-            return y
+        return self.normalization.apply(0, y)[1]
+
+    def normalize_point(self, x, y):
+        return self.normalization.apply(x, y)
 
     def normalize_delta(self, delta):
         if self.norm_extent:
@@ -207,21 +1342,28 @@ class ModelicaCoordinateSystem(ModelicaElement):
         self.scale = min(200.0/w, 200.0/h)
         self.x_center = (x1 + x2) / 2.0
         self.y_center = (y1 + y2) / 2.0
+        # maps points to the normalized coordinate system
+        self.normalization = IDENTITY
         if self.norm_extent:
+            self.normalization = Affine(
+                a=self.scale, d=self.scale, e=-self.x_center * self.scale,
+                f=-self.y_center * self.scale
+            )
             x1 = -w / 2.0 * self.scale
             x2 = +w / 2.0 * self.scale
             y1 = -h / 2.0 * self.scale
             y2 = +h / 2.0 * self.scale
         self.add_attribute(
-            "extent", "{{%s,%s},{%s,%s}}" % to_s(x1, y1, x2, y2)
+            "extent", format_numbers("{{%s,%s},{%s,%s}}", [x1, y1, x2, y2])
         )
 
     def find_extent(self, svg):
         w = to_f(svg.get("width"))
         h = to_f(svg.get("height"))
         if "viewBox" in svg.attrib:
-            ws = re.compile(r"\s+")
-            xv, yv, wv, hv = [to_f(s) for s in ws.split(svg.get("viewBox"))]
+            xv, yv, wv, hv = [
+                to_f(s) for s in re_ws.split(svg.get("viewBox"))
+            ]
             self.px2mm_factor_x = w / wv
             self.px2mm_factor_y = h / hv
             return [xv, yv-hv, xv+wv, yv]
@@ -233,84 +1375,513 @@ class ModelicaCoordinateSystem(ModelicaElement):
         self.set_extent(*ext)
 
 
+SUPPORTED_TAGS = frozenset(["rect", "path", "circle", "ellipse", "text"])
+# number of elements that are converted at once in streaming mode
+STREAM_CHUNK_SIZE = 1024
+# minimum number of elements that a worker process converts at once in a
+# parallel conversion
+PARALLEL_CHUNK_MIN = 256
+
+
+def primitive_class(el, tag, style):
+    # Modelica class to which an svg element with the computed css properties
+    # style is converted (None if it is not converted)
+    if tag == "rect":
+        return ModelicaRectangle
+    elif tag == "path":
+        if get_ns_attribute(el, "sodipodi", "type") == "arc":
+            return ModelicaEllipse
+        fill = style.get("fill")
+        if re_closed_path.match(el.get("d")):
+            return ModelicaPolygon
+        elif fill is not None and fill not in CSS_NO_COLOR:
+            return ModelicaPolygon
+        else:
+            return ModelicaLine
+    elif tag == "circle":
+        return ModelicaEllipse
+    elif tag == "ellipse":
+        return ModelicaEllipse
+    elif tag == "text":
+        return ModelicaText
+    return None
+    # TODO (nice to have) support bitmap images
+
+
+def convert_leaves(settings, svg, stylesheet, leaves):
+    # converts serialized elements given with their accumulated matrix (as
+    # tuple) and computed css properties in a worker process of a parallel
+    # conversion (see ModelicaGraphicsContainer.convert_parallel); svg is the
+    # serialized root element and the normalize_extent setting for the
+    # coordinate system (None if there is none)
+    # returns the code of each element and the number of points of lines and
+    # polygons before and after simplification
+    coords = None
+    if svg is not None:
+        root, normalize_extent = svg
+        coords = ModelicaCoordinateSystem(
+            etree.fromstring(root), normalize_extent=normalize_extent
+        )
+    container = ModelicaGraphicsContainer(None, coords=coords, **settings)
+    container.stylesheet = stylesheet
+    for data, matrix, style in leaves:
+        el = etree.fromstring(data)
+        container.add_row(el, tn(el), Affine(*matrix), style)
+    codes = [
+        container.element_code(m)
+        for m in container.convert_rows(container.pending)
+    ]
+    return codes, container.point_counts
+
+
 class ModelicaGraphicsContainer(object):
     def __init__(
             self, doc, n_indent=4, coords=None, strict=False,
-            text_extent="normal"
+            text_extent="normal", element_cache=None, simplify=0,
+            flatten_tolerance=0.1, point_budget=1000, compact=False, jobs=1
     ):
+        # doc may be None for a container whose elements are added with
+        # add_row (see convert_leaves)
         self.n_indent = n_indent
         self.elems = []
         self.coords = coords
         self.strict = strict
         self.text_extent = text_extent
-        self.add_descendants(doc.getroot())
-
-    def to_modelica(self, el):
+        self.element_cache = element_cache
+        self.simplify = simplify
+        self.flatten_tolerance = flatten_tolerance
+        self.point_budget = point_budget
+        self.compact = compact
+        # number of worker processes for converting the elements
+        self.jobs = jobs
+        # number of points of lines and polygons before and after
+        # simplification
+        self.point_counts = [0, 0]
+        # elements that still have to be converted by flush()
+        self.pending = GraphicsIR()
+        if element_cache is not None:
+            # everything besides the element itself and its ancestors that
+            # influences the conversion result
+            settings = [
+                n_indent, strict, text_extent, simplify, flatten_tolerance,
+                point_budget, compact
+            ]
+            if coords is not None:
+                settings.append(coords.norm_extent)
+                if coords.norm_extent:
+                    settings.extend([
+                        coords.scale, coords.x_center, coords.y_center
+                    ])
+            self.settings_key = repr(settings).encode("utf-8")
+        # sink to which flush() writes the converted elements directly
+        self.out = None
+        self.n_written = 0
+        # rules of <style> elements (in streaming mode they are added when
+        # they arrive and only apply to subsequent elements)
+        self.stylesheet = Stylesheet(strict)
+        # streamed documents are converted while they are written
+        self.stream = None
+        self.root = None
+        # index of the elements by id (built on the first <use> element) and
+        # the <use> elements that are currently instantiated
+        self.ids = None
+        self.instantiated = []
+        if isinstance(doc, SvgStream):
+            self.stream = doc
+        elif doc is not None:
+            self.root = doc.getroot()
+            for el in doc.getroot().iter("{*}style"):
+                self.add_stylesheet(el)
+            self.add_descendants(doc.getroot())
+
+    def add_stylesheet(self, el):
+        if el.get("type", "text/css") == "text/css":
+            self.stylesheet.add(el.text)
+
+    def element_key(self, el, parent_matrix, parent_style):
+        h = hashlib.sha1(self.settings_key)
+        h.update(etree.tostring(el, with_tail=False))
+        h.update(repr(parent_matrix).encode("utf-8"))
+        h.update(repr(sorted(parent_style.items())).encode("utf-8"))
+        h.update(self.stylesheet.key.encode("utf-8"))
+        return h.hexdigest()
+
+    def add_leaf(self, el, parent_matrix=IDENTITY, parent_style=EMPTY_STYLE):
+        # parent_matrix is the accumulated transformation matrix of all
+        # ancestors of el and parent_style the css properties inherited from
+        # them; the actual conversion is deferred to flush() so that the
+        # matrices of all elements can be decomposed in one batch
         tag = tn(el)
-        if not isinstance(el, etree._Element):
-            return None
-        if tag in ["defs", "metadata", "namedview"]:
-            return None
-        elif tag == "rect":
-            return ModelicaRectangle(
-                el, self.n_indent+1, coords=self.coords, strict=self.strict
-            )
-        elif tag == "path":
-            fill = get_style_attribute(el, "fill")
-            if get_ns_attribute(el, "sodipodi", "type") == "arc":
-                return ModelicaEllipse(
-                    el, self.n_indent+1, coords=self.coords, strict=self.strict
-                )
-            elif re.match(r".*[zZ]\s*$", el.get("d")):
-                return ModelicaPolygon(
-                    el, self.n_indent+1, coords=self.coords, strict=self.strict
-                )
-            elif fill is not None and (fill != "none"):
-                return ModelicaPolygon(
-                    el, self.n_indent+1, coords=self.coords, strict=self.strict
+        if tag in IGNORED_TAGS:
+            return False
+        if tag not in SUPPORTED_TAGS:
+            if self.strict:
+                raise MoNKError("tag {} is not supported".format(tag))
+            return False
+        key = None
+        if self.element_cache is not None:
+            key = self.element_key(el, parent_matrix, parent_style)
+            res = self.element_cache.get(key)
+            if res is not None:
+                if res != "":
+                    self.elems.append(CachedElement(res))
+                return False
+        matrix = parent_matrix.compose(
+            parse_transform(el.get("transform"), self.strict)
+        )
+        style = computed_style(el, parent_style, self.stylesheet)
+        self.add_row(el, tag, matrix, style, key)
+        return True
+
+    def add_row(self, el, tag, matrix, style, key=None):
+        # placeholder that is replaced by the converted element in flush()
+        self.pending.add(
+            primitive_class(el, tag, style), tag, el, len(self.elems), key,
+            matrix, style
+        )
+        self.elems.append(None)
+
+    def flush(self):
+        # converts all elements collected by add_leaf
+        ir = self.pending
+        self.pending = GraphicsIR()
+        if self.jobs > 1 and self.stream is None \
+                and len(ir) >= 2 * PARALLEL_CHUNK_MIN:
+            converted = self.convert_parallel(ir)
+        else:
+            converted = self.convert_rows(ir)
+        for i, m in zip(ir.slots, converted):
+            self.elems[i] = m
+        self.elems = [x for x in self.elems if x is not None]
+        if self.out is not None:
+            # streamed elements are written right away and then dropped
+            self.write_elements(self.out)
+            self.elems = []
+        return ir.elements
+
+    def convert_rows(self, ir):
+        # returns the Modelica elements for the rows of ir: the geometry of
+        # large batches is computed by the passes of GraphicsIR, the rest by
+        # the Modelica elements; instances of earlier rows are copied
+        ir.decompose(self.strict)
+        ir.find_instances()
+        np = None
+        if len(ir) >= GEOMETRY_BATCH_MIN:
+            try:
+                np = lazy_numpy()
+            except ImportError:
+                pass
+        if np is not None:
+            ir.place(self.coords, np)
+            ir.transform_extents(np)
+            if self.simplify == 0:
+                ir.transform_paths(
+                    self.flatten_tolerance, self.point_budget, self.strict, np
                 )
+        res = []
+        for i, el in enumerate(ir.elements):
+            j = ir.instances[i]
+            if j is not None and res[j] is not None:
+                m = res[j].instance(*ir.placement(i, self.coords))
             else:
-                return ModelicaLine(
-                    el, self.n_indent+1, coords=self.coords, strict=self.strict
+                m = self.convert_element(
+                    el, ir.matrices[i], ir.decompositions[i],
+                    ir.styles[ir.style_ids[i]], row=(ir, i)
                 )
-        elif tag == "circle":
-            return ModelicaEllipse(
-                el, self.n_indent+1, coords=self.coords, strict=self.strict
-            )
-        elif tag == "ellipse":
-            return ModelicaEllipse(
-                el, self.n_indent+1, coords=self.coords, strict=self.strict
-            )
-        elif tag == "text":
-            return ModelicaText(
-                el, self.n_indent+1, coords=self.coords, strict=self.strict,
-                extent=self.text_extent
+                if m is not None:
+                    m.release_conversion_state()
+            if isinstance(m, ModelicaPath) and m.point_counts is not None:
+                self.point_counts[0] += m.point_counts[0]
+                self.point_counts[1] += m.point_counts[1]
+            if ir.keys[i] is not None:
+                self.element_cache.put(ir.keys[i], self.element_code(m))
+            res.append(m)
+        return res
+
+    def convert_parallel(self, ir):
+        # converts the rows of ir in chunks of consecutive elements by worker
+        # processes, which return the code of each element; the code is
+        # written in document order like elements from the element cache, so
+        # that the result is identical to a sequential conversion
+        from concurrent.futures import ProcessPoolExecutor
+        n = len(ir)
+        # a few chunks per worker to balance the load
+        size = max(PARALLEL_CHUNK_MIN, -(-n // (4 * self.jobs)))
+        settings = dict(
+            n_indent=self.n_indent, strict=self.strict,
+            text_extent=self.text_extent, simplify=self.simplify,
+            flatten_tolerance=self.flatten_tolerance,
+            point_budget=self.point_budget, compact=self.compact
+        )
+        svg = None
+        if self.coords is not None:
+            # attributes of the root element that determine the coordinates
+            root = etree.Element(
+                self.root.tag, dict(self.root.attrib), nsmap=self.root.nsmap
             )
+            svg = etree.tostring(root), self.coords.norm_extent
+        codes = []
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [
+                executor.submit(
+                    convert_leaves, settings, svg, self.stylesheet, [
+                        (
+                            etree.tostring(el, with_tail=False),
+                            ir.matrices[i].to_tuple(),
+                            ir.styles[ir.style_ids[i]]
+                        )
+                        for i, el in enumerate(
+                            ir.elements[start:start+size], start
+                        )
+                    ]
+                )
+                for start in range(0, n, size)
+            ]
+            for fut in futures:
+                chunk, point_counts = fut.result()
+                codes.extend(chunk)
+                self.point_counts[0] += point_counts[0]
+                self.point_counts[1] += point_counts[1]
+        res = []
+        for code, key in zip(codes, ir.keys):
+            if key is not None:
+                self.element_cache.put(key, code)
+            res.append(CachedElement(code) if code != "" else None)
+        return res
+
+    def element_code(self, m):
+        # code of a converted element as stored in the element cache
+        if m is None:
+            return ""
+        out = StringWriter()
+        m.write(CompactWriter(out) if self.compact else out)
+        return out.getvalue()
+
+    def convert_element(
+            self, el, matrix=IDENTITY, decomposition=None, style=None,
+            row=None
+    ):
+        # matrix is the accumulated transformation matrix of el itself and
+        # style its computed css properties; row is the (GraphicsIR, index)
+        # of the element if it is converted in a batch
+        if style is None:
+            style = computed_style(el, stylesheet=self.stylesheet)
+        if row is None:
+            kind = primitive_class(el, tn(el), style)
         else:
-            if self.strict:
-                raise MoNKError("tag {} is not supported".format(tag))
+            kind = row[0].kinds[row[1]]
+        if kind is None:
             return None
-        # TODO (nice to have) support bitmap images
-
-    def add_descendants(self, el):
-        for c in el.iterchildren():
-            if tn(c) == "g":
-                self.add_descendants(c)
+        kwargs = dict(
+            coords=self.coords, strict=self.strict, matrix=matrix,
+            decomposition=decomposition, style=style, row=row
+        )
+        if kind is ModelicaText:
+            kwargs["extent"] = self.text_extent
+            kwargs["stylesheet"] = self.stylesheet
+        elif issubclass(kind, ModelicaPath):
+            kwargs["simplify"] = self.simplify
+            kwargs["flatten_tolerance"] = self.flatten_tolerance
+            kwargs["point_budget"] = self.point_budget
+        return kind(el, self.n_indent+1, **kwargs)
+
+    def add_descendants(self, el, matrix=None, style=None):
+        # matrix is the accumulated transformation matrix of el and style the
+        # css properties that its children inherit, which are passed down the
+        # hierarchy so that each transform and style is parsed once
+        top = matrix is None
+        if top:
+            matrix = parse_transform(el.get("transform"), self.strict)
+            style = inherited_style(
+                computed_style(el, EMPTY_STYLE, self.stylesheet)
+            )
+        # skip comments and processing instructions
+        for c in el.iterchildren(tag=etree.Element):
+            tag = tn(c)
+            if tag == "g":
+                self.add_descendants(
+                    c,
+                    matrix.compose(
+                        parse_transform(c.get("transform"), self.strict)
+                    ),
+                    inherited_style(computed_style(c, style, self.stylesheet))
+                )
+            elif tag == "use":
+                self.add_use(c, matrix, style)
             else:
-                m = self.to_modelica(c)
-                if m is not None:
-                    self.elems.append(m)
+                self.add_leaf(c, matrix, style)
+        if top:
+            self.flush()
+
+    def element_by_id(self, element_id):
+        if self.ids is None:
+            self.ids = {}
+            for el in self.root.iter(tag=etree.Element):
+                if "id" in el.attrib:
+                    self.ids.setdefault(el.get("id"), el)
+        return self.ids.get(element_id)
+
+    def is_cyclic(self, el, target):
+        # true if the <use> element el references an element that contains
+        # el, i.e. el itself, one of its ancestors or one of the <use>
+        # elements (or their ancestors) that are currently instantiated
+        for use in [el] + self.instantiated:
+            if use is target or any(
+                a is target for a in use.iterancestors()
+            ):
+                return True
+        return False
+
+    def add_use(self, el, parent_matrix, parent_style):
+        # adds the element referenced by a <use> element, which is treated
+        # like the only child of a group with the transform and the css
+        # properties of the <use> element that is moved by its x and y
+        # attributes; the rows of all instances of an element are converted
+        # only once (see GraphicsIR.find_instances)
+        # NOT SUPPORTED (svg): references to other documents, width, height
+        # and viewBox of <symbol> elements
+        href = el.get("href", el.get(XLINK_HREF))
+        target = None
+        if href is not None and href.startswith("#"):
+            target = self.element_by_id(href[1:])
+        if target is None:
+            if self.strict:
+                raise MoNKError("cannot instantiate reference {}".format(href))
+            return
+        if self.is_cyclic(el, target):
+            # the instances would never end
+            if self.strict:
+                raise MoNKError("cyclic reference {}".format(href))
+            sys.stderr.write(
+                "warning: skipped cyclic reference {}\n".format(href)
+            )
+            return
+        tag = tn(target)
+        if tag == "symbol" and "viewBox" in target.attrib and self.strict:
+            raise MoNKError("viewBox of <symbol> is not supported")
+        x = to_f(el.get("x", "0"))
+        y = to_f(el.get("y", "0"))
+        matrix = parent_matrix.compose(
+            parse_transform(el.get("transform"), self.strict)
+        ).compose(FLIP.compose(Affine(e=x, f=y)).compose(FLIP))
+        style = inherited_style(
+            computed_style(el, parent_style, self.stylesheet)
+        )
+        self.instantiated.append(el)
+        try:
+            if tag in ("g", "symbol"):
+                self.add_descendants(
+                    target,
+                    matrix.compose(
+                        parse_transform(target.get("transform"), self.strict)
+                    ),
+                    inherited_style(
+                        computed_style(target, style, self.stylesheet)
+                    )
+                )
+            elif tag == "use":
+                self.add_use(target, matrix, style)
+            else:
+                self.add_leaf(target, matrix, style)
+        finally:
+            self.instantiated.pop()
+
+    def add_streamed_descendants(self, stream):
+        # same traversal as add_descendants, but elements are converted in
+        # chunks as soon as their end events arrive and are freed afterwards
+        leaf = None
+        # <use> elements may reference elements that were already freed
+        skipped_uses = 0
+        # accumulated transformation matrices and inherited css properties of
+        # the open groups
+        matrices = [parse_transform(stream.root.get("transform"), self.strict)]
+        styles = [inherited_style(
+            computed_style(stream.root, EMPTY_STYLE, self.stylesheet)
+        )]
+        for event, el in stream.events:
+            if event == "start":
+                if leaf is None and tn(el) == "g":
+                    matrices.append(matrices[-1].compose(
+                        parse_transform(el.get("transform"), self.strict)
+                    ))
+                    styles.append(inherited_style(
+                        computed_style(el, styles[-1], self.stylesheet)
+                    ))
+                elif leaf is None:
+                    leaf = el
+                continue
+            if tn(el) == "style":
+                self.add_stylesheet(el)
+            if el is leaf:
+                leaf = None
+                if tn(el) == "use":
+                    if self.strict:
+                        raise MoNKError(
+                            "<use> is not supported in streaming mode"
+                        )
+                    skipped_uses += 1
+                elif self.add_leaf(el, matrices[-1], styles[-1]):
+                    if len(self.pending) >= STREAM_CHUNK_SIZE:
+                        self.free_flushed(self.flush())
+                    continue
+            elif leaf is None and tn(el) == "g":
+                matrices.pop()
+                styles.pop()
+                # the group is about to be cleared including its children
+                self.free_flushed(self.flush())
+            elif leaf is not None and tn(leaf) == "text":
+                # text elements need their children (tspans) for conversion
+                continue
+            # anything else (including the contents of ignored subtrees like
+            # <metadata> or <defs>) can be dropped right away, but previous
+            # siblings that are still waiting for conversion must be kept
+            if self.pending:
+                el.clear()
+            else:
+                free_element(el)
+        self.flush()
+        if skipped_uses > 0:
+            sys.stderr.write(
+                "warning: skipped {} <use> elements, which are not supported"
+                " in streaming mode\n".format(skipped_uses)
+            )
+
+    def free_flushed(self, elements):
+        for el in elements:
+            el.clear()
+        if elements:
+            free_element(elements[-1])
 
     def add_element(self, modelica_el):
         self.elems.append(modelica_el)
 
     def __str__(self):
-        inner = "\n"+INDENT*self.n_indent
-        inner += (",\n"+INDENT*self.n_indent).join(
-            [str(x) for x in self.elems]
-        )
-        inner += "\n"+INDENT*(self.n_indent-1)
-        return "{" + inner + "}"
+        out = StringWriter()
+        self.write(out)
+        return out.getvalue()
+
+    def write(self, out):
+        out.write("{")
+        self.n_written = 0
+        if self.stream is not None:
+            self.out = out
+            try:
+                self.add_streamed_descendants(self.stream)
+            finally:
+                self.out = None
+                self.stream = None
+        else:
+            self.write_elements(out)
+        if self.n_written == 0:
+            out.write("\n"+INDENT*self.n_indent)
+        out.write("\n"+INDENT*(self.n_indent-1) + "}")
+
+    def write_elements(self, out):
+        line_delim = "\n" + INDENT*self.n_indent
+        for x in self.elems:
+            out.write(("," if self.n_written > 0 else "") + line_delim)
+            x.write(out)
+            self.n_written += 1
 
 
 class LinePattern:
@@ -348,207 +1919,502 @@ class Smooth:
     BEZIER = "Smooth.Bezier"
 
 
+re_transform = re.compile(
+    r"[\s,]*(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)[\s,]*"
+)
+re_number = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+
+# allowed numbers of arguments for each transform function
+TRANSFORM_ARITIES = {
+    "matrix": (6,), "translate": (1, 2), "scale": (1, 2), "rotate": (1, 3),
+    "skewX": (1,), "skewY": (1,)
+}
+
+# Inkscape repeats the same transform strings for many elements
+transform_cache = LRUCache(4096)
+
+
+def transform_function_matrix(name, args):
+    if name == "matrix":
+        return Affine(*args)
+    elif name == "translate":
+        tx = args[0]
+        ty = args[1] if len(args) > 1 else 0.0
+        return Affine(e=tx, f=ty)
+    elif name == "scale":
+        sx = args[0]
+        sy = args[1] if len(args) > 1 else sx
+        return Affine(a=sx, d=sy)
+    elif name == "rotate":
+        alpha = args[0] / 180.0 * math.pi
+        c = math.cos(alpha)
+        s = math.sin(alpha)
+        mat = Affine(c, s, -s, c)
+        if len(args) > 1:
+            # rotation around (cx, cy)
+            cx, cy = args[1:]
+            mat = Affine(e=cx, f=cy).compose(mat).compose(
+                Affine(e=-cx, f=-cy)
+            )
+        return mat
+    elif name == "skewX":
+        t = math.tan(args[0] / 180.0 * math.pi)
+        return Affine(c=t)
+    elif name == "skewY":
+        t = math.tan(args[0] / 180.0 * math.pi)
+        return Affine(b=t)
+
+
+def parse_transform_list(transform):
+    # parses a complete SVG transform list and returns the resulting matrix
+    # in SVG coordinates or None if the transform string is invalid
+    mat = IDENTITY
+    pos = 0
+    while pos < len(transform):
+        m = re_transform.match(transform, pos)
+        if m is None:
+            # only whitespace is allowed after the last transform
+            return mat if transform[pos:].strip() == "" else None
+        name = m.group(1)
+        args = [float(x) for x in re_number.findall(m.group(2))]
+        if len(args) not in TRANSFORM_ARITIES[name]:
+            return None
+        # the rightmost transform is applied first to the coordinates
+        mat = mat.compose(transform_function_matrix(name, args))
+        pos = m.end()
+    return mat
+
+
+def parse_transform(transform, strict=False):
+    if transform is None:
+        return IDENTITY
+    mat = transform_cache.get(transform)
+    if mat is None:
+        mat = parse_transform_list(transform)
+        if mat is None:
+            if strict:
+                raise MoNKError("cannot handle transform={}".format(transform))
+            # ignore what we cannot handle
+            return IDENTITY
+        # flip coordinates, apply matrix to flipped points and flip back again
+        # this is required because the y axis of the SVG coordinate system
+        # starts at the top but the y axis of modelica starts at the bottom of
+        # the icon
+        mat = FLIP.compose(mat).compose(FLIP)
+        transform_cache.put(transform, mat)
+    return mat
+
+
+# minimum number of matrices for which numpy is used in decompose_matrices
+DECOMPOSE_BATCH_MIN = 64
+
+
+def decompose_matrices(mats, strict=False):
+    # vectorized version of Affine.decompose for a list of matrices, which
+    # returns a list of (tx, ty, sx, sy, alpha) tuples
+    if len(mats) < DECOMPOSE_BATCH_MIN:
+        return [m.decompose(strict) for m in mats]
+    try:
+        np = lazy_numpy()
+    except ImportError:
+        return [m.decompose(strict) for m in mats]
+    # one row (a, b, c, d, e, f) per matrix
+    m = np.array([x.to_tuple() for x in mats], dtype="float64")
+    a, b, c, d, tx, ty = m.T
+    sx = np.sqrt(a ** 2 + b ** 2)
+    sy = np.sqrt(c ** 2 + d ** 2)
+    flipped = np.where(
+        np.abs(b) > 1e-10,
+        np.sign(b) == np.sign(c),
+        np.sign(a) != np.sign(d)
+    )
+    sx = np.where(flipped, -sx, sx)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = np.where(
+            sx != 0, np.arctan2(b / sx, a / sx), np.arctan2(-c, d)
+        )
+    if strict:
+        ref = np.stack([
+            sx * np.cos(alpha), sx * np.sin(alpha),
+            sy * -np.sin(alpha), sy * np.cos(alpha), tx, ty
+        ], axis=1)
+        reducible = np.all(np.isclose(m, ref, rtol=1e-4, atol=1e-3), axis=1)
+        if not np.all(reducible):
+            # let the scalar version raise the error for the first offender
+            mats[int(np.argmin(reducible))].decompose(strict)
+    return list(zip(
+        tx.tolist(), ty.tolist(), sx.tolist(), sy.tolist(), alpha.tolist()
+    ))
+
+
+# minimum number of elements for which GraphicsIR computes the geometry of its
+# rows with numpy
+GEOMETRY_BATCH_MIN = 64
+
+
+class GraphicsIR(object):
+    # columnar intermediate representation of the elements that a container
+    # converts at once: the traversal adds one row per element and the passes
+    # compute the geometry of all rows with a few array operations, so that
+    # the Modelica elements only have to pick up their results
+    # the columns of a pass are None until it has run, in which case the
+    # elements compute the values themselves
+    def __init__(self):
+        # Modelica class, tag, svg element, index in the elements of the
+        # container and element cache key of each row
+        self.kinds = []
+        self.tags = []
+        self.elements = []
+        self.slots = []
+        self.keys = []
+        # accumulated transformation matrix and index of the computed css
+        # properties in styles (rows with the same style object share it)
+        self.matrices = []
+        self.style_ids = []
+        self.styles = []
+        self.style_index = {}
+        # results of decompose
+        self.decompositions = None
+        # result of find_instances: index of an earlier row that the row is
+        # an instance of (or None)
+        self.instances = None
+        # results of place: formatted origin and rotation (None if there is
+        # no rotation), point transform as Affine and as (N, 6) array and the
+        # offsets of the origins (see GraphicItem.set_origin)
+        self.origins = None
+        self.rotations = None
+        self.transforms = None
+        self.transform_array = None
+        self.offsets = None
+        # result of transform_extents: formatted extent of rectangles and
+        # ellipses
+        self.extents = None
+        # results of transform_paths: parsed path data (subpaths, smooth) and
+        # formatted points of lines and polygons
+        self.paths = None
+        self.points = None
+        # attributes set by FilledShape.autoset_shape_values per style
+        self.shape_values = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def add(self, kind, tag, el, slot, key, matrix, style):
+        style_id = self.style_index.get(id(style))
+        if style_id is None:
+            style_id = len(self.styles)
+            self.style_index[id(style)] = style_id
+            self.styles.append(style)
+        self.kinds.append(kind)
+        self.tags.append(tag)
+        self.elements.append(el)
+        self.slots.append(slot)
+        self.keys.append(key)
+        self.matrices.append(matrix)
+        self.style_ids.append(style_id)
+
+    def decompose(self, strict=False):
+        self.decompositions = decompose_matrices(self.matrices, strict)
+
+    def find_instances(self):
+        # rows that convert the same element with the same scale and css
+        # properties as an earlier row (like the elements referenced by
+        # several <use> elements), whose conversion result only differs in
+        # origin and rotation (requires decompose)
+        self.instances = [None] * len(self)
+        first = {}
+        for i, el in enumerate(self.elements):
+            _, _, sx, sy, _ = self.decompositions[i]
+            j = first.setdefault((id(el), sx, sy), i)
+            if j == i:
+                continue
+            a = self.style_ids[i]
+            b = self.style_ids[j]
+            if a == b or self.styles[a] == self.styles[b]:
+                self.instances[i] = j
+
+    def placement(self, i, coords):
+        # formatted origin and rotation (None if there is no rotation) of row
+        # i like GraphicItem.autoset_rotation_and_origin
+        if self.origins is not None:
+            return self.origins[i], self.rotations[i]
+        tx, ty, _, _, alpha = self.decompositions[i]
+        if coords is not None:
+            tx, ty = coords.normalize_point(tx, ty)
+        rotation = None
+        if nonzero(alpha):
+            rotation = to_s(alpha/math.pi*180)
+        return format_numbers("{%s,%s}", [tx, ty]), rotation
+
+    def place(self, coords, np):
+        # origin, rotation and point transform of every row like
+        # GraphicItem.autoset_rotation_and_origin
+        tx, ty, sx, sy, alpha = np.array(
+            self.decompositions, dtype="float64"
+        ).reshape(-1, 5).T
+        n = len(self)
+        norm = IDENTITY
+        x, y = tx, ty
+        self.offsets = (0, 0)
+        if coords is not None:
+            norm = coords.normalization
+            x, y = coords.normalize_point(tx, ty)
+            self.offsets = (-norm.e, -norm.f)
+        self.origins = format_numbers(
+            "\n".join(["{%s,%s}"] * n),
+            np.column_stack([x, y]).ravel().tolist()
+        ).split("\n")
+        self.rotations = [None] * n
+        rotated = np.flatnonzero(np.abs(alpha) > 1e-10)
+        if len(rotated) > 0:
+            degrees = format_numbers(
+                "\n".join(["%s"] * len(rotated)),
+                (alpha[rotated] / math.pi * 180).tolist()
+            ).split("\n")
+            for i, deg in zip(rotated.tolist(), degrees):
+                self.rotations[i] = deg
+        t = Affine(e=self.offsets[0], f=self.offsets[1]).compose(norm).compose(
+            Affine(a=sx, d=-sy)
+        )
+        self.transform_array = np.column_stack([
+            np.broadcast_to(v, (n,)) for v in t.to_tuple()
+        ])
+        self.transforms = [
+            Affine(*row) for row in self.transform_array.tolist()
+        ]
+
+    def transform_extents(self, np):
+        # extents of rectangles and ellipses (requires place)
+        rows = []
+        boxes = []
+        for i, kind in enumerate(self.kinds):
+            if kind is not ModelicaRectangle and kind is not ModelicaEllipse:
+                continue
+            if self.instances[i] is not None:
+                continue
+            try:
+                boxes.append(svg_extent(self.elements[i], self.tags[i]))
+            except (TypeError, ValueError):
+                # invalid attributes are reported by the element itself
+                continue
+            rows.append(i)
+        self.extents = [None] * len(self)
+        if not rows:
+            return
+        boxes = np.array(boxes, dtype="float64")
+        t = Affine(*self.transform_array[rows].T)
+        x1, y1 = t.apply(boxes[:, 0], boxes[:, 1])
+        x2, y2 = t.apply(boxes[:, 2], boxes[:, 3])
+        extents = format_numbers(
+            "\n".join(["{{%s,%s},{%s,%s}}"] * len(rows)),
+            np.column_stack([x1, y1, x2, y2]).ravel().tolist()
+        ).split("\n")
+        for i, extent in zip(rows, extents):
+            self.extents[i] = extent
+
+    def transform_paths(
+            self, flatten_tolerance, point_budget, strict, np
+    ):
+        # parses the path data of lines and polygons and transforms, quantizes
+        # and formats the points of all of them in one buffer like
+        # ModelicaPath.set_points without simplification (requires place)
+        self.paths = [None] * len(self)
+        self.points = [None] * len(self)
+        rows = []
+        chunks = []
+        counts = []
+        for i, kind in enumerate(self.kinds):
+            if kind is not ModelicaPolygon and kind is not ModelicaLine:
+                continue
+            if self.instances[i] is not None:
+                continue
+            try:
+                subpaths, smooth = parse_path_data(
+                    self.elements[i].get("d"), self.transforms[i],
+                    flatten_tolerance, point_budget, strict
+                )
+            except Exception:
+                # the element parses the path again to report the error in
+                # document order
+                continue
+            self.paths[i] = subpaths, smooth
+            if smooth:
+                # control points are neither quantized nor removed
+                continue
+            rows.append(i)
+            n = 0
+            for points in subpaths:
+                points = np.asarray(points, dtype="float64").reshape(-1, 2)
+                chunks.append(points)
+                n += len(points)
+            counts.append(n)
+        if not rows:
+            return
+        points = np.concatenate(chunks) if chunks else np.zeros((0, 2))
+        t = Affine(*np.repeat(self.transform_array[rows], counts, axis=0).T)
+        xs, ys = t.apply(points[:, 0], points[:, 1])
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        points, offsets = quantize_point_buffer(
+            np.column_stack([xs, ys]), offsets
+        )
+        for i, formatted in zip(rows, format_point_buffer(points, offsets)):
+            self.points[i] = formatted
+
+
 class GraphicItem(object):
-    def __init__(self, coords):
+    __slots__ = (
+        "coords", "style", "matrix", "decomposition", "offset_x", "offset_y",
+        "point_transform", "tx", "ty", "sx", "sy", "strict", "row"
+    )
+
+    def __init__(
+            self, coords, matrix=None, decomposition=None, style=None,
+            row=None
+    ):
         self.coords = coords
+        # computed css properties of the element (determined with
+        # computed_style if not given)
+        self.style = style
+        # accumulated transformation matrix of the element and its ancestors
+        # (determined with get_matrix if not given)
+        self.matrix = matrix
+        # result of matrix.decompose(), if it is already known
+        self.decomposition = decomposition
         self.offset_x = None
         self.offset_y = None
-
-    def x_coord(self, x):
-        res = self.scale_x(x)
-        if self.coords is not None:
-            res = self.coords.normalize_x(res)
-        res += self.offset_x
-        return res
-
-    def y_coord(self, y):
-        res = self.scale_y(-y)
-        if self.coords is not None:
-            res = self.coords.normalize_y(res)
-        res += self.offset_y
-        return res
+        # maps coordinates of the element to Modelica coordinates relative to
+        # its origin (set by autoset_rotation_and_origin)
+        self.point_transform = None
+        # (GraphicsIR, index) of the element, if it is converted in a batch
+        self.row = row
+
+    def ir_column(self, name):
+        # value of the element in a column of its GraphicsIR (None if the
+        # column has not been computed)
+        if self.row is None:
+            return None
+        ir, i = self.row
+        column = getattr(ir, name)
+        return None if column is None else column[i]
+
+    def transform_points(self, points):
+        # applies point_transform to a list of [x, y] pairs or an (N, 2) array
+        # and returns a list of (x, y) tuples
+        t = self.point_transform
+        if isinstance(points, list):
+            return [t.apply(x, y) for x, y in points]
+        xs, ys = t.apply(points[:, 0], points[:, 1])
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def transform_array(self, points):
+        # applies point_transform to an (N, 2) array
+        xs, ys = self.point_transform.apply(points[:, 0], points[:, 1])
+        return lazy_numpy().column_stack([xs, ys])
+
+    def transform_extent(self, x1, y1, x2, y2):
+        return list(
+            self.point_transform.apply(x1, y1)
+            + self.point_transform.apply(x2, y2)
+        )
 
     def set_origin(self, x, y):
         if self.coords is not None:
-            x = self.coords.normalize_x(x)
-            y = self.coords.normalize_y(y)
+            x, y = self.coords.normalize_point(x, y)
             # remove translational part that comes just from different origin
-            self.offset_x = -self.coords.normalize_x(0)
-            self.offset_y = -self.coords.normalize_y(0)
+            self.offset_x = -self.coords.normalization.e
+            self.offset_y = -self.coords.normalization.f
         else:
             # every translation should be applied to all points
             self.offset_x = 0
             self.offset_y = 0
-        self.add_attribute("origin", "{%s,%s}" % to_s(x, y))
+        self.add_attribute("origin", format_numbers("{%s,%s}", [x, y]))
 
     def set_rotation(self, deg):
         self.add_attribute("rotation", to_s(deg))
 
+    def instance(self, origin, rotation):
+        # copy of the converted element with another origin and rotation
+        res = copy.copy(self)
+        res.values = list(self.values)
+        res.add_attribute("origin", origin)
+        if rotation is None:
+            res.remove_attribute("rotation")
+        else:
+            res.add_attribute("rotation", rotation)
+        return res
+
+    def release_conversion_state(self):
+        # converted elements only need their attribute values for writing,
+        # so the matrices and styles used for the conversion can be dropped
+        # while the element waits to be written
+        self.style = None
+        self.matrix = None
+        self.decomposition = None
+        self.point_transform = None
+        self.tx = self.ty = self.sx = self.sy = None
+        self.row = None
+
+    def get_style(self, el):
+        if self.style is None:
+            self.style = computed_style(el)
+        return self.style
+
     def get_matrix(self, el):
         # get the transformation matrix for this element
         if el is None:
-            return np.eye(3, dtype="float32")
+            return IDENTITY
         mpar = self.get_matrix(el.getparent())
         mel = self.parse_transform(el.get("transform"))
-        return np.dot(mpar, mel)
+        return mpar.compose(mel)
 
     def parse_transform(self, transform):
-        if transform is None:
-            return np.eye(3, dtype="float32")
-        # handle multiple transform statements in one string
-        parts = re.findall(r"[a-zA-Z]+\s*\([-\d.,\s]+\)", transform)
-        if len(parts) > 1:
-            mat = np.eye(3, dtype="float32")
-            # parse and apply individual transforms right to left
-            for p in reversed(parts):
-                mat = np.dot(mat, parse_fransform(p))
-            return mat
-        exp_matrix = re.compile(r"""
-            \s*matrix\s*
-            \(
-                \s*(-?\d+\.?\d*)[\s,]+
-                \s*(-?\d+\.?\d*)[\s,]+
-                \s*(-?\d+\.?\d*)[\s,]+
-                \s*(-?\d+\.?\d*)[\s,]+
-                \s*(-?\d+\.?\d*)[\s,]+
-                \s*(-?\d+\.?\d*)\s*
-            \)\s*
-        """, re.VERBOSE)
-        exp_translate = re.compile(r"""
-            \s*translate\s*
-            \(
-                \s*(-?\d+\.?\d*)[\s,]+
-                \s*(-?\d+\.?\d*)\s*
-            \)
-        """, re.VERBOSE)
-        exp_rotate = re.compile(r"""
-            \s*rotate\s*
-            \(
-                \s*(-?\d+\.?\d*)\s*
-                (?:[\s,]+
-                    \s*(-?\d+\.?\d*)[\s,]+
-                    \s*(-?\d+\.?\d*)\s*
-                )?
-            \)
-        """, re.VERBOSE)
-        m_mat = exp_matrix.match(transform)
-        m_trans = exp_translate.match(transform)
-        m_rot = exp_rotate.match(transform)
-        if m_mat is not None:
-            g = [float(x) for x in m_mat.groups()]
-            mat = np.array([
-                [g[0], g[2], g[4]],
-                [g[1], g[3], g[5]],
-                [0, 0, 1]
-            ])
-        elif m_trans is not None:
-            g = [float(x) for x in m_trans.groups()]
-            mat = np.array([
-                [1, 0, g[0]],
-                [0, 1, g[1]],
-                [0, 0, 1]
-            ])
-        elif m_rot is not None:
-            g = [float(x) if x is not None else x for x in m_rot.groups()]
-            if g[1] is not None:
-                t = self.parse_transform(
-                    "translate({1}, {2})".format(g[1], g[2])
-                )
-                r = self.parse_transform("rotate({1})".format(g[0]))
-                ti = self.parse_transform(
-                    "translate({1}, {2})".format(-g[1], -g[2])
-                )
-                mat = np.dot(np.dot(t, r), ti)
-            else:
-                alpha = float(g[0]) / 180.0 * np.pi
-                mat = np.array([
-                    [np.cos(alpha), -np.sin(alpha), 0],
-                    [np.sin(alpha), np.cos(alpha), 0],
-                    [0, 0, 1]
-                ])
-        else:
-            # NOT SUPPORTED: does not handle skew and scale
-            if self.strict:
-                raise MoNKError("cannot handle transform={}".format(transform))
-            # ignore what we cannot handle
-            mat = np.eye(3, dtype="float32")
-
-        flip = np.array([[1, 0, 0], [0, -1, 0], [0, 0, 1]], dtype="float32")
-        # flip coordinates, apply matrix to flipped points and flip back again
-        # this is required because the y axis of the SVG coordinate system
-        # starts at the top but the y axis of modelica starts at the bottom of
-        # the icon
-        return np.dot(np.dot(flip, mat), flip)
+        return parse_transform(transform, self.strict)
 
     def decompose_matrix(self, mat):
-        # decompose transformation matrix to angle + origin form
-        # we assume that the matrix has the following form
-        # sx * cos(alpha)   -sy * sin(alpha)   tx
-        # sx * sin(alpha)    sy * cos(alpha)   ty
-        #      0                   0            1
-        # 1. Get translation
-        tx = mat[0, 2]
-        ty = mat[1, 2]
-        # 2. Get scaling (since sin²(x) + cos²(x) = 1)
-        sx = np.sqrt(mat[0, 0] ** 2 + mat[1, 0] ** 2)
-        sy = np.sqrt(mat[0, 1] ** 2 + mat[1, 1] ** 2)
-        # sign for scaling is ambiguous due to symmetries in trigonometric
-        # functions (sin(-x) = -sin(x) and cos(-x) = cos(x))
-        # therefore we only look for the sign of the diagonal and arbitrarily
-        # flip one of the axes if required
-        if not nonzero(mat[1, 0]):
-            flipped = np.sign(mat[0, 0]) != np.sign(mat[1, 1])
-        else:
-            flipped = np.sign(mat[1, 0]) == np.sign(mat[0, 1])
-        if flipped:
-            sx *= -1
-        # 3. Remove scaling and obtain rotational angle
-        alpha = np.arctan2(mat[1, 0] / sx, mat[0, 0] / sx)
-        if self.strict:
-            # check that decomposed matrix equals the original matrix
-            ref = np.array(
-                [
-                    [sx * np.cos(alpha), sy * -np.sin(alpha), tx],
-                    [sx * np.sin(alpha), sy * np.cos(alpha), ty],
-                    [0, 0, 1]
-                ],
-                dtype="float32"
-            )
-            if not np.all(np.isclose(
-                    mat.flatten(), ref.flatten(), rtol=1e-4, atol=1e-3
-            )):
-                raise MoNKError("".join([
-                    "Transformation matrix is not reducible to angle + ",
-                    "origin [+ scaling] form.\n\n",
-                    "{0}\n!=\n{1}"
-                ]).format(mat, ref))
-        return tx, ty, sx, sy, alpha
+        return mat.decompose(self.strict)
 
     def autoset_rotation_and_origin(self, el):
-        mat = self.get_matrix(el)
-        tx, ty, sx, sy, alpha = self.decompose_matrix(mat)
-        self.set_origin(tx, ty)
-        if nonzero(alpha):
-            self.set_rotation(alpha/np.pi*180)
+        if self.decomposition is not None:
+            tx, ty, sx, sy, alpha = self.decomposition
+        else:
+            mat = self.matrix
+            if mat is None:
+                mat = self.get_matrix(el)
+            tx, ty, sx, sy, alpha = self.decompose_matrix(mat)
         self.tx = tx
         self.ty = ty
         self.sx = sx
         self.sy = sy
-
-    def scale_x(self, x):
-        return self.scale(x, self.sx)
-
-    def scale_y(self, y):
-        return self.scale(y, self.sy)
+        origin = self.ir_column("origins")
+        if origin is not None:
+            # computed for all rows by GraphicsIR.place
+            ir, i = self.row
+            self.offset_x, self.offset_y = ir.offsets
+            self.add_attribute("origin", origin)
+            if ir.rotations[i] is not None:
+                self.add_attribute("rotation", ir.rotations[i])
+            self.point_transform = ir.transforms[i]
+            return
+        self.set_origin(tx, ty)
+        if nonzero(alpha):
+            self.set_rotation(alpha/math.pi*180)
+        # scaling of the element, flipped y axis, normalization of the extent
+        # and removal of the offset
+        norm = IDENTITY if self.coords is None else self.coords.normalization
+        self.point_transform = Affine(
+            e=self.offset_x, f=self.offset_y
+        ).compose(norm).compose(Affine(a=sx, d=-sy))
 
     def scale_thickness(self, x):
-        return self.scale(x, np.mean([abs(self.sx), abs(self.sy)]))
+        return self.scale(x, (abs(self.sx) + abs(self.sy)) / 2.0)
 
     def scale(self, val, s):
         return val * s
 
 
 class FilledShape(object):
+    __slots__ = ()
+
     def set_line_color(self, r, g, b):
         self.add_attribute(
             "lineColor", "{%d,%d,%d}" % (round(r), round(g), round(b))
@@ -560,21 +2426,20 @@ class FilledShape(object):
             self.add_attribute("lineColor", lc)
 
     def find_line_color(self, el):
-        att = get_style_attribute(el, "stroke")
-        return self.attribute_value_to_color(att)
+        att = self.get_style(el).get("stroke")
+        return self.attribute_value_to_color(att, el)
 
-    def attribute_value_to_color(self, att):
-        if att is None or att == "none":
+    def attribute_value_to_color(self, att, el=None):
+        if att is None or att in CSS_NO_COLOR:
             return None
-        if att.startswith("#"):
-            return self.css_hex_to_modelica(att)
-        if att.startswith("rgb"):
-            return self.css_rgb_to_modelica(att)
-        if self.strict:
-            # NOT SUPPORTED: currentColor, inherit, url(),
-            # css color names
+        if att == "currentColor" and el is not None:
+            # the initial value of the color property is black
+            att = self.get_style(el).get("color", "black")
+        color = css_color_to_modelica(att)
+        if color is None and self.strict:
+            # NOT SUPPORTED: inherit, url()
             raise MoNKError("color definition {} is not supported".format(att))
-        return None
+        return color
 
     def set_fill_color(self, r, g, b):
         self.add_attribute(
@@ -582,8 +2447,8 @@ class FilledShape(object):
         )
 
     def find_fill_color(self, el):
-        att = get_style_attribute(el, "fill")
-        return self.attribute_value_to_color(att)
+        att = self.get_style(el).get("fill")
+        return self.attribute_value_to_color(att, el)
 
     def autoset_fill_color(self, el):
         fc = self.find_fill_color(el)
@@ -594,8 +2459,8 @@ class FilledShape(object):
         self.add_attribute("pattern", lp)
 
     def find_line_pattern(self, el):
-        att = get_style_attribute(el, "stroke")
-        if att == "none":
+        att = self.get_style(el).get("stroke")
+        if att in CSS_NO_COLOR:
             return LinePattern.NONE
         # NOT SUPPORTED: Dash, Dot, DashDot, DashDotDot,
         # NOT SUPPORTED: css stroke-dasharray and stroke-dashoffset values
@@ -613,16 +2478,15 @@ class FilledShape(object):
         self.add_attribute("fillPattern", lp)
 
     def has_fill(self):
-        return "fillPattern" in self.data \
-            and self.data["fillPattern"] != FillPattern.NONE
+        fp = self.get_attribute("fillPattern")
+        return fp is not None and fp != FillPattern.NONE
 
     def has_stroke(self):
-        return "pattern" not in self.data \
-            or self.data["pattern"] != LinePattern.NONE
+        return self.get_attribute("pattern") != LinePattern.NONE
 
     def find_fill_pattern(self, el):
-        att = get_style_attribute(el, "fill")
-        if att == "none":
+        att = self.get_style(el).get("fill")
+        if att in CSS_NO_COLOR:
             return FillPattern.NONE
         # NOT SUPPORTED (modelica): Horizontal Vertical Cross Forward
         # Backward CrossDiag HorizontalCylinder VerticalCylinder Sphere
@@ -643,7 +2507,7 @@ class FilledShape(object):
         self.add_attribute("lineThickness", to_s(x))
 
     def find_line_thickness(self, el):
-        att = get_style_attribute(el, "stroke-width")
+        att = self.get_style(el).get("stroke-width")
         if att is None:
             return None
         if "%" in att or att == "inherit":
@@ -659,36 +2523,76 @@ class FilledShape(object):
         if val is not None and self.has_stroke():
             self.set_line_thickness(val)
 
-    def css_hex_to_modelica(self, hexstr):
-        hexstr = hexstr[1:]
-        sz = 2 if len(hexstr) > 3 else 1
-        return "{%d,%d,%d}" % tuple(
-            [int(hexstr[i*sz:i*sz+sz], 16) for i in range(3)]
-        )
-
-    def css_rgb_to_modelica(self, rgbstr):
-        match = re.match(
-            r"\s*rgb\s*\(\s*(\d+\%?)\s*,\s*(\d+\%?)\s*,\s*(\d+\%?)\s*\)\s*",
-            rgbstr
-        )
-        rgb = match.groups()
-        if "%" in rgb[0]:
-            rgb = [round(int(x[0:-2])*255.0/100) for x in rgb]
+    def autoset_shape_values(self, el):
+        if self.row is None:
+            self.autoset_style_values(el)
         else:
-            rgb = [int(x) for x in rgb]
-        return "{%d,%d,%d}" % rgb
+            # patterns and colors only depend on the css properties and are
+            # therefore determined once per style of a GraphicsIR
+            ir, i = self.row
+            values = ir.shape_values.get(ir.style_ids[i])
+            if values is None:
+                before = list(self.values)
+                self.autoset_style_values(el)
+                values = [
+                    (name, v) for name, v, old
+                    in zip(self.FIELDS, self.values, before) if v is not old
+                ]
+                ir.shape_values[ir.style_ids[i]] = values
+            else:
+                for name, v in values:
+                    self.add_attribute(name, v)
+        self.autoset_line_thickness(el)
 
-    def autoset_shape_values(self, el):
+    def autoset_style_values(self, el):
         self.autoset_line_pattern(el)
         self.autoset_fill_pattern(el)
         self.autoset_line_color(el)
         self.autoset_fill_color(el)
-        self.autoset_line_thickness(el)
+
+
+def svg_extent(el, tag):
+    # bounding box (x1, y1, x2, y2) of a rect, circle, ellipse or Inkscape
+    # ellipse arc in the coordinates of the element
+    if tag == "rect":
+        x = float(el.get("x"))
+        y = float(el.get("y"))
+        w = float(el.get("width"))
+        h = float(el.get("height"))
+        return x, y, x+w, y+h
+    if tag == "circle":
+        cx = float(el.get("cx"))
+        cy = float(el.get("cy"))
+        rx = float(el.get("r"))
+        ry = float(el.get("r"))
+    elif tag == "ellipse":
+        cx = float(el.get("cx"))
+        cy = float(el.get("cy"))
+        rx = float(el.get("rx"))
+        ry = float(el.get("ry"))
+    elif tag == "path":
+        cx = float(get_ns_attribute(el, "sodipodi", "cx"))
+        cy = float(get_ns_attribute(el, "sodipodi", "cy"))
+        rx = float(get_ns_attribute(el, "sodipodi", "rx"))
+        ry = float(get_ns_attribute(el, "sodipodi", "ry"))
+    return cx-rx, cy-ry, cx+rx, cy+ry
 
 
 class ModelicaEllipse(ModelicaElement, GraphicItem, FilledShape):
-    def __init__(self, el, n_indent=5, coords=None, strict=False):
-        GraphicItem.__init__(self, coords)
+    FIELDS, FIELD_INDEX = record_fields(
+        "extent", *MODELICA_DEFAULTS["Ellipse"]
+    )
+    __slots__ = ModelicaElement.SLOTS
+    PLAIN_VALUES = True
+
+    def __init__(
+            self, el, n_indent=5, coords=None, strict=False, matrix=None,
+            decomposition=None, style=None, row=None
+    ):
+        GraphicItem.__init__(
+            self, coords, matrix=matrix, decomposition=decomposition,
+            style=style, row=row
+        )
         ModelicaElement.__init__(
             self, "Ellipse", el, n_indent, coords=coords, strict=strict
         )
@@ -703,7 +2607,7 @@ class ModelicaEllipse(ModelicaElement, GraphicItem, FilledShape):
     def set_angles(self,  startAngle, endAngle):
         if nonzero(startAngle):
             self.add_attribute("startAngle", to_s(startAngle))
-        if not np.isclose(endAngle, 360):
+        if not isclose(endAngle, 360):
             self.add_attribute("endAngle", to_s(endAngle))
 
     def autoset_angles(self, el):
@@ -713,47 +2617,44 @@ class ModelicaEllipse(ModelicaElement, GraphicItem, FilledShape):
         end = float(get_ns_attribute(el, "sodipodi", "end"))
         # NOTE: inkscape has clockwise angles
         # Modelica angles are counter-clockwise
-        startAngle = 360 - end / np.pi * 180.0
-        endAngle = 360 - start / np.pi * 180.0
+        startAngle = 360 - end / math.pi * 180.0
+        endAngle = 360 - start / math.pi * 180.0
         if startAngle > endAngle:
             startAngle -= 360
         self.set_angles(startAngle, endAngle)
 
     def set_extent(self,  x1, y1, x2, y2):
         self.add_attribute(
-            "extent", "{{%s,%s},{%s,%s}}" % to_s(x1, y1, x2, y2)
+            "extent", format_numbers("{{%s,%s},{%s,%s}}", [x1, y1, x2, y2])
         )
 
     def find_extent(self,  el):
-        tag = tn(el)
-        if tag == "circle":
-            cx = float(el.get("cx"))
-            cy = float(el.get("cy"))
-            rx = float(el.get("r"))
-            ry = float(el.get("r"))
-        elif tag == "ellipse":
-            cx = float(el.get("cx"))
-            cy = float(el.get("cy"))
-            rx = float(el.get("rx"))
-            ry = float(el.get("ry"))
-        elif tag == "path":
-            cx = float(get_ns_attribute(el, "sodipodi", "cx"))
-            cy = float(get_ns_attribute(el, "sodipodi", "cy"))
-            rx = float(get_ns_attribute(el, "sodipodi", "rx"))
-            ry = float(get_ns_attribute(el, "sodipodi", "ry"))
-        return [
-            self.x_coord(cx-rx), self.y_coord(cy-ry),
-            self.x_coord(cx+rx), self.y_coord(cy+ry)
-        ]
+        return self.transform_extent(*svg_extent(el, tn(el)))
 
     def autoset_extent(self,  el):
+        extent = self.ir_column("extents")
+        if extent is not None:
+            self.add_attribute("extent", extent)
+            return
         ext = self.find_extent(el)
         self.set_extent(*ext)
 
 
 class ModelicaRectangle(ModelicaElement, GraphicItem, FilledShape):
-    def __init__(self, el, n_indent=5, coords=None, strict=False):
-        GraphicItem.__init__(self, coords)
+    FIELDS, FIELD_INDEX = record_fields(
+        "extent", *MODELICA_DEFAULTS["Rectangle"]
+    )
+    __slots__ = ModelicaElement.SLOTS
+    PLAIN_VALUES = True
+
+    def __init__(
+            self, el, n_indent=5, coords=None, strict=False, matrix=None,
+            decomposition=None, style=None, row=None
+    ):
+        GraphicItem.__init__(
+            self, coords, matrix=matrix, decomposition=decomposition,
+            style=style, row=row
+        )
         ModelicaElement.__init__(
             self, "Rectangle", el, n_indent=n_indent, coords=coords,
             strict=strict
@@ -769,20 +2670,17 @@ class ModelicaRectangle(ModelicaElement, GraphicItem, FilledShape):
 
     def set_extent(self, x1, y1, x2, y2):
         self.add_attribute(
-            "extent", "{{%s,%s},{%s,%s}}" % to_s(x1, y1, x2, y2)
+            "extent", format_numbers("{{%s,%s},{%s,%s}}", [x1, y1, x2, y2])
         )
 
     def find_extent(self, el):
-        x = float(el.get("x"))
-        y = float(el.get("y"))
-        w = float(el.get("width"))
-        h = float(el.get("height"))
-        return [
-            self.x_coord(x), self.y_coord(y),
-            self.x_coord(x+w), self.y_coord(y+h)
-        ]
+        return self.transform_extent(*svg_extent(el, "rect"))
 
     def autoset_extent(self, el):
+        extent = self.ir_column("extents")
+        if extent is not None:
+            self.add_attribute("extent", extent)
+            return
         ext = self.find_extent(el)
         self.set_extent(*ext)
 
@@ -805,7 +2703,7 @@ class ModelicaRectangle(ModelicaElement, GraphicItem, FilledShape):
             ry = 0
         rx = float(rx)
         ry = float(ry)
-        if self.strict and not np.isclose(rx, ry):
+        if self.strict and not isclose(rx, ry):
             raise MoNKError(
                 "rx and ry must be equal ({} != {})".format(rx, ry)
             )
@@ -819,9 +2717,814 @@ class ModelicaRectangle(ModelicaElement, GraphicItem, FilledShape):
         self.add_attribute("borderPattern", bp)
 
 
+# number of arguments of each path command
+PATH_ARITIES = {
+    "M": 2, "L": 2, "H": 1, "V": 1, "Z": 0, "C": 6, "S": 4, "Q": 4, "T": 2,
+    "A": 7
+}
+# arguments of an elliptical arc (rx ry x-axis-rotation large-arc-flag
+# sweep-flag x y)
+re_arc_args = re.compile(
+    r"[\s,]*({0})[\s,]*({0})[\s,]*({0})[\s,]*([01])[\s,]*([01])"
+    r"[\s,]*({0})[\s,]*({0})".format(re_number.pattern)
+)
+# indices of the x coordinates of all points in the arguments of a command
+PATH_POINT_ARGS = {
+    "M": (0,), "L": (0,), "T": (0,), "C": (0, 2, 4), "S": (0, 2),
+    "Q": (0, 2), "A": (5,)
+}
+# minimum length of path data for which numpy is used for tokenizing and
+# evaluating a path
+PATH_BATCH_MIN = 2048
+# minimum number of segments of a path with curves for which numpy is used
+# for flattening
+FLATTEN_BATCH_MIN = 64
+# lookup tables (byte value -> bool) for tokenize_path_vectorized
+path_byte_tables = None
+
+
+def tokenize_path(d):
+    # splits path data into a string of all commands, the number of arguments
+    # of each command and the numeric arguments of all commands
+    # (a list for short paths and a numpy array for long paths)
+    if len(d) >= PATH_BATCH_MIN:
+        try:
+            res = tokenize_path_vectorized(d, lazy_numpy())
+            if res is not None:
+                return res
+        except ImportError:
+            pass
+    commands = []
+    counts = []
+    values = []
+    for cmd, args in re_path_command.findall(d):
+        if cmd in "Aa":
+            # flags of arcs do not need to be separated from other numbers
+            args = [x for arc in re_arc_args.findall(args) for x in arc]
+        else:
+            args = re_number.findall(args)
+        commands.append(cmd)
+        counts.append(len(args))
+        values.extend(float(x) for x in args)
+    return "".join(commands), counts, values
+
+
+def tokenize_path_vectorized(d, np):
+    # returns None if the path data cannot be tokenized this way (because it
+    # contains numbers that are not separated by whitespace or commas like
+    # "1-2" or "1.5.5")
+    global path_byte_tables
+    if path_byte_tables is None:
+        is_cmd = np.zeros(256, dtype=bool)
+        is_cmd[bytearray(b"MmZzLlHhVvCcSsQqTtAa")] = True
+        is_sep = np.zeros(256, dtype=bool)
+        is_sep[bytearray(b" \t\r\n\x0c,")] = True
+        path_byte_tables = is_cmd, is_sep
+    is_cmd, is_sep = path_byte_tables
+    try:
+        chars = np.frombuffer(d.encode("ascii"), dtype=np.uint8)
+    except UnicodeError:
+        return None
+    cmd = is_cmd[chars]
+    cmd_pos = np.flatnonzero(cmd)
+    if frozenset(chars[cmd_pos].tobytes().decode("ascii")) & frozenset("Aa"):
+        # arc flags need the regular expressions of tokenize_path
+        return None
+    sep = is_sep[chars] | cmd
+    starts = np.flatnonzero(~sep & np.concatenate([[True], sep[:-1]]))
+    tokens = np.where(sep, 32, chars).astype(np.uint8).tobytes().split()
+    try:
+        values = np.array(tokens, dtype="float64")
+    except ValueError:
+        return None
+    # index of the command that each number belongs to
+    owner = np.searchsorted(cmd_pos, starts) - 1
+    values = values[owner >= 0]
+    counts = np.bincount(owner[owner >= 0], minlength=len(cmd_pos))
+    return chars[cmd_pos].tobytes().decode("ascii"), counts, values
+
+
+def check_path_arities(commands, counts):
+    for cmd, n in zip(commands, counts):
+        arity = PATH_ARITIES[cmd.upper()]
+        if n % max(arity, 1) != 0 or (n == 0) != (arity == 0):
+            raise MoNKError(
+                "wrong number of arguments for path command {}".format(cmd)
+            )
+
+
+def evaluate_path(commands, counts, values, strict=False):
+    # evaluates a path consisting only of moveto, lineto and closepath
+    # commands and returns the list of its subpaths, each of which is a
+    # sequence of absolute [x, y] coordinates (an (N, 2) array if values is
+    # a numpy array)
+    if strict:
+        check_path_arities(commands, counts)
+    if isinstance(values, list):
+        return evaluate_path_scalar(commands, counts, values)
+    return evaluate_path_vectorized(commands, counts, values, lazy_numpy())
+
+
+def evaluate_path_scalar(commands, counts, values):
+    subpaths = []
+    points = []
+    x = y = 0.0
+    # start of the current subpath
+    x0 = y0 = 0.0
+    pos = 0
+    for cmd, n in zip(commands, counts):
+        args = values[pos:pos + n]
+        pos += n
+        if cmd in "Zz":
+            if len(points) > 1:
+                subpaths.append(points)
+            points = []
+            x, y = x0, y0
+            continue
+        arity = PATH_ARITIES[cmd.upper()]
+        for i in range(0, n - n % arity, arity):
+            if cmd in "Mm" and i == 0:
+                if len(points) > 1:
+                    subpaths.append(points)
+                points = []
+            elif len(points) == 0:
+                # implicit subpath after closepath
+                points.append([x, y])
+            if cmd in "MmLl":
+                if cmd.islower():
+                    x += args[i]
+                    y += args[i+1]
+                else:
+                    x = args[i]
+                    y = args[i+1]
+            elif cmd == "H":
+                x = args[i]
+            elif cmd == "h":
+                x += args[i]
+            elif cmd == "V":
+                y = args[i]
+            elif cmd == "v":
+                y += args[i]
+            if cmd in "Mm" and i == 0:
+                x0, y0 = x, y
+            points.append([x, y])
+    if len(points) > 1:
+        subpaths.append(points)
+    return subpaths
+
+
+def evaluate_path_vectorized(commands, counts, values, np):
+    codes = np.frombuffer(commands.encode("ascii"), dtype=np.uint8)
+    upper = codes & 0xDF
+    relative = codes != upper
+    arity_table = np.zeros(256, dtype="int64")
+    for k, v in PATH_ARITIES.items():
+        arity_table[ord(k)] = v
+    arities = arity_table[upper]
+    counts = np.asarray(counts, dtype="int64")
+    # one segment per repetition of a command (closepath has one segment)
+    reps = np.where(arities > 0, counts // np.maximum(arities, 1), 1)
+    seg_upper = np.repeat(upper, reps)
+    seg_relative = np.repeat(relative, reps)
+    starts = np.repeat(np.cumsum(counts) - counts, reps)
+    rank = np.arange(len(seg_upper)) - np.repeat(np.cumsum(reps) - reps, reps)
+    offsets = starts + rank * np.repeat(arities, reps)
+    is_xy = (seg_upper == ord("M")) | (seg_upper == ord("L"))
+    # index of the x and y value of each segment (-1 if it is kept)
+    xi = np.where(is_xy | (seg_upper == ord("H")), offsets, -1)
+    yi = np.where(
+        is_xy, offsets + 1, np.where(seg_upper == ord("V"), offsets, -1)
+    )
+    moveto = (seg_upper == ord("M")) & (rank == 0)
+    close = seg_upper == ord("Z")
+    # every moveto and every segment after a closepath starts a subpath
+    new = moveto | np.concatenate([[True], close[:-1]])
+    bounds = np.flatnonzero(new).tolist() + [len(seg_upper)]
+    subpaths = []
+    x = y = 0.0
+    for s, e in zip(bounds[:-1], bounds[1:]):
+        # a closepath ends the subpath and has no point on its own
+        end = e - 1 if close[e-1] else e
+        if end <= s:
+            continue
+        x0 = x
+        y0 = y
+        xs = resolve_path_axis(x, values, xi[s:end], seg_relative[s:end], np)
+        ys = resolve_path_axis(y, values, yi[s:end], seg_relative[s:end], np)
+        if moveto[s]:
+            x0 = xs[0]
+            y0 = ys[0]
+            points = np.column_stack([xs, ys])
+        else:
+            points = np.column_stack([
+                np.concatenate([[x], xs]), np.concatenate([[y], ys])
+            ])
+        if len(points) > 1:
+            subpaths.append(points)
+        if close[e-1]:
+            x, y = x0, y0
+        else:
+            x, y = xs[-1], ys[-1]
+    return subpaths
+
+
+def path_segments(commands, counts, values):
+    # resolves all commands of a path to absolute coordinates and returns a
+    # list of segments (kind, points...) with the kinds
+    # "M" (start of a subpath): point
+    # "L": end point
+    # "Q": start point, control point, end point
+    # "C": start point, two control points, end point
+    # "A": start point, radii, x-axis rotation, flags, end point
+    segments = []
+    x = y = 0.0
+    # start of the current subpath
+    x0 = y0 = 0.0
+    started = False
+    # kind and last control point of the previous segment for S and T
+    last = None
+    ctrl = None
+    pos = 0
+    for cmd, n in zip(commands, counts):
+        kind = cmd.upper()
+        args = values[pos:pos + n]
+        pos += n
+        if kind == "Z":
+            x, y = x0, y0
+            started = False
+            last = None
+            continue
+        arity = PATH_ARITIES[kind]
+        for i in range(0, n - n % arity, arity):
+            a = [float(v) for v in args[i:i + arity]]
+            if cmd.islower():
+                for k in PATH_POINT_ARGS.get(kind, ()):
+                    a[k] += x
+                    a[k+1] += y
+                if kind == "H":
+                    a[0] += x
+                elif kind == "V":
+                    a[0] += y
+            if kind == "M" and i == 0:
+                x0, y0 = x, y = a[0], a[1]
+                segments.append(("M", (x, y)))
+                started = True
+                last = None
+                continue
+            if not started:
+                # implicit subpath after closepath or at the beginning
+                x0, y0 = x, y
+                segments.append(("M", (x, y)))
+                started = True
+            start = (x, y)
+            if kind in "ML":
+                x, y = a[0], a[1]
+                segments.append(("L", (x, y)))
+            elif kind == "H":
+                x = a[0]
+                segments.append(("L", (x, y)))
+            elif kind == "V":
+                y = a[0]
+                segments.append(("L", (x, y)))
+            elif kind in "CS":
+                if kind == "C":
+                    c1 = (a[0], a[1])
+                    a = a[2:]
+                elif last in ("C", "S"):
+                    c1 = (2 * x - ctrl[0], 2 * y - ctrl[1])
+                else:
+                    c1 = start
+                ctrl = (a[0], a[1])
+                x, y = a[2], a[3]
+                segments.append(("C", start, c1, ctrl, (x, y)))
+            elif kind in "QT":
+                if kind == "Q":
+                    ctrl = (a[0], a[1])
+                    a = a[2:]
+                elif last in ("Q", "T"):
+                    ctrl = (2 * x - ctrl[0], 2 * y - ctrl[1])
+                else:
+                    ctrl = start
+                x, y = a[0], a[1]
+                segments.append(("Q", start, ctrl, (x, y)))
+            elif kind == "A":
+                x, y = a[5], a[6]
+                if a[0] == 0 or a[1] == 0 or start == (x, y):
+                    # degenerate arcs are straight lines
+                    segments.append(("L", (x, y)))
+                else:
+                    segments.append((
+                        "A", start, (abs(a[0]), abs(a[1])), a[2],
+                        (a[3] != 0, a[4] != 0), (x, y)
+                    ))
+            last = kind
+    return segments
+
+
+def quadratic_spline_points(segments):
+    # returns the points of a Smooth.Bezier line that is identical to the
+    # given segments or None if there is no such line
+    # Smooth.Bezier uses the points as control points of quadratic Bezier
+    # curves that join at the midpoints between the points (except for the
+    # first and last point), so the path must consist of a single open
+    # sequence of quadratic curves whose joints are such midpoints
+    if len(segments) < 2 or segments[0][0] != "M":
+        return None
+    if any(seg[0] != "Q" for seg in segments[1:]):
+        return None
+    points = [segments[0][1]]
+    for i, (_, start, ctrl, end) in enumerate(segments[1:]):
+        if i > 0:
+            prev = points[-1]
+            mid = ((prev[0] + ctrl[0]) / 2.0, (prev[1] + ctrl[1]) / 2.0)
+            if not (isclose(mid[0], start[0]) and isclose(mid[1], start[1])):
+                return None
+        points.append(ctrl)
+    points.append(segments[-1][3])
+    return [[x, y] for x, y in points]
+
+
+def flatten_segments(segments, tolerance, budget, np):
+    # approximates all curves by polylines that deviate at most tolerance from
+    # the curve and returns the list of subpaths as (N, 2) arrays
+    # if the path would have more than budget points, the curves are
+    # approximated with proportionally fewer points (at least one per curve,
+    # a budget of 0 means no limit)
+    if not tolerance > 0:
+        raise MoNKError("flatten tolerance must be positive")
+    if budget < 0:
+        raise MoNKError("point budget must not be negative")
+    kinds = np.array([seg[0] for seg in segments])
+    counts = np.ones(len(segments), dtype="int64")
+    curves = np.flatnonzero((kinds == "C") | (kinds == "Q"))
+    arcs = np.flatnonzero(kinds == "A")
+    if len(curves) > 0:
+        ctrl = np.array([
+            cubic_control_points(segments[i]) for i in curves
+        ], dtype="float64")
+        # Wang's formula for the number of subdivisions of a cubic curve
+        dd = np.maximum(
+            np.hypot(*(ctrl[:, 0] - 2 * ctrl[:, 1] + ctrl[:, 2]).T),
+            np.hypot(*(ctrl[:, 1] - 2 * ctrl[:, 2] + ctrl[:, 3]).T)
+        )
+        counts[curves] = np.ceil(np.sqrt(0.75 * dd / tolerance))
+    if len(arcs) > 0:
+        arc = arc_center_parameters([segments[i] for i in arcs], np)
+        cx, cy, rx, ry, phi, theta, delta = arc
+        # maximum angle between points so that the distance between chord
+        # and arc is at most tolerance
+        r = np.maximum(rx, ry)
+        ratio = tolerance / r
+        step = 2 * np.arccos(np.clip(1 - ratio, -1, 1))
+        # 1 - ratio rounds to 1 if the tolerance is tiny compared to the
+        # radius, arccos(1 - x) = 2 * arcsin(sqrt(x / 2)) does not
+        step = np.where(
+            step > 0, step, 4 * np.arcsin(np.sqrt(np.minimum(ratio, 2) / 2))
+        )
+        counts[arcs] = np.ceil(np.abs(delta) / np.maximum(step, 1e-9))
+    counts = np.maximum(counts, 1)
+    smooth = np.concatenate([curves, arcs])
+    if 0 < budget < counts.sum() and len(smooth) > 0:
+        available = max(budget - (len(segments) - len(smooth)), len(smooth))
+        counts[smooth] = np.maximum(
+            counts[smooth] * available // counts[smooth].sum(), 1
+        )
+    offsets = np.cumsum(counts) - counts
+    points = np.empty((counts.sum(), 2))
+    lines = np.flatnonzero((kinds == "M") | (kinds == "L"))
+    points[offsets[lines]] = [segments[i][-1] for i in lines]
+    if len(curves) > 0:
+        seg, t = curve_parameters(counts[curves], np)
+        c = ctrl[seg]
+        t = t[:, None]
+        points[offsets[curves][seg] + curve_ranks(counts[curves], np)] = (
+            (1 - t) ** 3 * c[:, 0] + 3 * (1 - t) ** 2 * t * c[:, 1]
+            + 3 * (1 - t) * t ** 2 * c[:, 2] + t ** 3 * c[:, 3]
+        )
+    if len(arcs) > 0:
+        seg, t = curve_parameters(counts[arcs], np)
+        angle = theta[seg] + t * delta[seg]
+        cos_phi = np.cos(phi[seg])
+        sin_phi = np.sin(phi[seg])
+        ex = rx[seg] * np.cos(angle)
+        ey = ry[seg] * np.sin(angle)
+        points[offsets[arcs][seg] + curve_ranks(counts[arcs], np)] = (
+            np.column_stack([
+                cx[seg] + cos_phi * ex - sin_phi * ey,
+                cy[seg] + sin_phi * ex + cos_phi * ey
+            ])
+        )
+    # end points are taken exactly from the path data
+    ends = np.concatenate([curves, arcs])
+    points[offsets[ends] + counts[ends] - 1] = [
+        segments[i][-1] for i in ends
+    ]
+    subpaths = np.split(points, offsets[kinds == "M"][1:])
+    return [p for p in subpaths if len(p) > 1]
+
+
+def flatten_segments_scalar(segments, tolerance, budget):
+    # flatten_segments for paths with few segments, which does not need numpy
+    # and returns the subpaths as lists of [x, y] pairs
+    if not tolerance > 0:
+        raise MoNKError("flatten tolerance must be positive")
+    if budget < 0:
+        raise MoNKError("point budget must not be negative")
+    counts = []
+    # control points of the curves and center parameters of the arcs
+    params = {}
+    for i, seg in enumerate(segments):
+        n = 1
+        if seg[0] in "CQ":
+            c0, c1, c2, c3 = params[i] = cubic_control_points(seg)
+            # Wang's formula for the number of subdivisions of a cubic curve
+            dd = max(
+                math.hypot(c0[0] - 2 * c1[0] + c2[0],
+                           c0[1] - 2 * c1[1] + c2[1]),
+                math.hypot(c1[0] - 2 * c2[0] + c3[0],
+                           c1[1] - 2 * c2[1] + c3[1])
+            )
+            n = ceil_count(math.sqrt(0.75 * dd / tolerance))
+        elif seg[0] == "A":
+            params[i] = arc = arc_center_parameters_scalar(seg)
+            _, _, rx, ry, _, _, delta = arc
+            ratio = tolerance / max(rx, ry)
+            step = 2 * math.acos(min(max(1 - ratio, -1), 1))
+            if not step > 0:
+                step = 4 * math.asin(math.sqrt(min(ratio, 2) / 2))
+            n = ceil_count(abs(delta) / max(step, 1e-9))
+        counts.append(max(n, 1))
+    smooth = sorted(params)
+    if 0 < budget < sum(counts) and len(smooth) > 0:
+        available = max(budget - (len(segments) - len(smooth)), len(smooth))
+        total = sum(counts[i] for i in smooth)
+        for i in smooth:
+            counts[i] = max(counts[i] * available // total, 1)
+    subpaths = [[]]
+    for i, (seg, n) in enumerate(zip(segments, counts)):
+        if seg[0] == "M" and i > 0:
+            subpaths.append([])
+        points = subpaths[-1]
+        if seg[0] in "CQ":
+            c0, c1, c2, c3 = params[i]
+            for k in range(1, n):
+                t = k / float(n)
+                s = 1 - t
+                points.append([
+                    s ** 3 * c0[j] + 3 * (s * s) * t * c1[j]
+                    + 3 * s * (t * t) * c2[j] + t ** 3 * c3[j]
+                    for j in (0, 1)
+                ])
+        elif seg[0] == "A":
+            cx, cy, rx, ry, phi, theta, delta = params[i]
+            cos_phi = math.cos(phi)
+            sin_phi = math.sin(phi)
+            for k in range(1, n):
+                angle = theta + k / float(n) * delta
+                ex = rx * math.cos(angle)
+                ey = ry * math.sin(angle)
+                points.append([
+                    cx + cos_phi * ex - sin_phi * ey,
+                    cy + sin_phi * ex + cos_phi * ey
+                ])
+        # end points are taken exactly from the path data
+        points.append(list(seg[-1]))
+    return [p for p in subpaths if len(p) > 1]
+
+
+def ceil_count(x):
+    # number of points of a curve, where non-finite values (from infinite
+    # coordinates) give a single point
+    if math.isinf(x) or math.isnan(x):
+        return 1
+    return int(math.ceil(x))
+
+
+def cubic_control_points(segment):
+    if segment[0] == "C":
+        return segment[1:]
+    # degree elevation of a quadratic curve
+    p0, q, p3 = segment[1:]
+    return (
+        p0,
+        (p0[0] + 2.0 / 3 * (q[0] - p0[0]), p0[1] + 2.0 / 3 * (q[1] - p0[1])),
+        (p3[0] + 2.0 / 3 * (q[0] - p3[0]), p3[1] + 2.0 / 3 * (q[1] - p3[1])),
+        p3
+    )
+
+
+def curve_parameters(counts, np):
+    # returns for each point of a set of curves with the given numbers of
+    # points the index of the curve and the curve parameter t in (0, 1]
+    seg = np.repeat(np.arange(len(counts)), counts)
+    t = (curve_ranks(counts, np) + 1) / counts[seg].astype("float64")
+    return seg, t
+
+
+def curve_ranks(counts, np):
+    # index of each point within its curve
+    offsets = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(offsets, counts)
+
+
+def arc_center_parameters(arcs, np):
+    # conversion from endpoint to center parameterization for a list of
+    # "A" segments (SVG 1.1, appendix F.6.5 and F.6.6), returns arrays
+    # cx, cy, rx, ry, phi, theta (start angle) and delta (sweep angle)
+    x1, y1 = np.array([a[1] for a in arcs], dtype="float64").T
+    rx, ry = np.array([a[2] for a in arcs], dtype="float64").T
+    phi = np.radians([a[3] for a in arcs])
+    large, sweep = np.array([a[4] for a in arcs], dtype=bool).T
+    x2, y2 = np.array([a[5] for a in arcs], dtype="float64").T
+    cos_phi = np.cos(phi)
+    sin_phi = np.sin(phi)
+    dx = (x1 - x2) / 2
+    dy = (y1 - y2) / 2
+    x1p = cos_phi * dx + sin_phi * dy
+    y1p = -sin_phi * dx + cos_phi * dy
+    # scale up radii that are too small
+    scale = np.sqrt(np.maximum(x1p ** 2 / rx ** 2 + y1p ** 2 / ry ** 2, 1))
+    rx = rx * scale
+    ry = ry * scale
+    num = rx ** 2 * ry ** 2 - rx ** 2 * y1p ** 2 - ry ** 2 * x1p ** 2
+    den = rx ** 2 * y1p ** 2 + ry ** 2 * x1p ** 2
+    coef = np.sqrt(np.maximum(num / den, 0))
+    coef = np.where(large == sweep, -coef, coef)
+    cxp = coef * rx * y1p / ry
+    cyp = -coef * ry * x1p / rx
+    cx = cos_phi * cxp - sin_phi * cyp + (x1 + x2) / 2
+    cy = sin_phi * cxp + cos_phi * cyp + (y1 + y2) / 2
+    theta = np.arctan2((y1p - cyp) / ry, (x1p - cxp) / rx)
+    theta2 = np.arctan2((-y1p - cyp) / ry, (-x1p - cxp) / rx)
+    delta = theta2 - theta
+    delta = np.where(sweep & (delta < 0), delta + 2 * np.pi, delta)
+    delta = np.where(~sweep & (delta > 0), delta - 2 * np.pi, delta)
+    return cx, cy, rx, ry, phi, theta, delta
+
+
+def arc_center_parameters_scalar(arc):
+    # arc_center_parameters for a single "A" segment
+    _, (x1, y1), (rx, ry), phi, (large, sweep), (x2, y2) = arc
+    phi = math.radians(phi)
+    cos_phi = math.cos(phi)
+    sin_phi = math.sin(phi)
+    dx = (x1 - x2) / 2
+    dy = (y1 - y2) / 2
+    x1p = cos_phi * dx + sin_phi * dy
+    y1p = -sin_phi * dx + cos_phi * dy
+    # scale up radii that are too small
+    scale = math.sqrt(
+        max((x1p * x1p) / (rx * rx) + (y1p * y1p) / (ry * ry), 1)
+    )
+    rx = rx * scale
+    ry = ry * scale
+    num = (
+        (rx * rx) * (ry * ry) - (rx * rx) * (y1p * y1p)
+        - (ry * ry) * (x1p * x1p)
+    )
+    den = (rx * rx) * (y1p * y1p) + (ry * ry) * (x1p * x1p)
+    coef = math.sqrt(max(num / den, 0)) if den > 0 else 0.0
+    if large == sweep:
+        coef = -coef
+    cxp = coef * rx * y1p / ry
+    cyp = -coef * ry * x1p / rx
+    cx = cos_phi * cxp - sin_phi * cyp + (x1 + x2) / 2
+    cy = sin_phi * cxp + cos_phi * cyp + (y1 + y2) / 2
+    theta = math.atan2((y1p - cyp) / ry, (x1p - cxp) / rx)
+    theta2 = math.atan2((-y1p - cyp) / ry, (-x1p - cxp) / rx)
+    delta = theta2 - theta
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+    return cx, cy, rx, ry, phi, theta, delta
+
+
+def simplify_points(points, tolerance, np):
+    # Ramer-Douglas-Peucker simplification of an (N, 2) array: only points
+    # that are farther than tolerance away from the simplified polyline are
+    # kept, including the first and the last point
+    # the recursive splitting is done for all intervals at the same time
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    # points that lie in intervals that may still have to be split
+    active = np.arange(1, len(points) - 1)
+    while len(active) > 0:
+        ends = np.flatnonzero(keep)
+        interval = np.searchsorted(ends, active) - 1
+        a = points[ends[interval]]
+        ab = points[ends[interval + 1]] - a
+        ap = points[active] - a
+        length = np.hypot(ab[:, 0], ab[:, 1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dist = np.where(
+                length > 0,
+                np.abs(ab[:, 0] * ap[:, 1] - ab[:, 1] * ap[:, 0]) / length,
+                # closed polylines start and end at the same point
+                np.hypot(ap[:, 0], ap[:, 1])
+            )
+        # active points are sorted, so each interval is a contiguous group
+        change = np.concatenate([[True], interval[1:] != interval[:-1]])
+        group = np.cumsum(change) - 1
+        farthest = np.maximum.reduceat(dist, np.flatnonzero(change))
+        split = (farthest > tolerance)[group]
+        # split each interval at its (first) farthest point
+        candidates = np.flatnonzero(split & (dist == farthest[group]))
+        _, first = np.unique(group[candidates], return_index=True)
+        keep[active[candidates[first]]] = True
+        split[candidates[first]] = False
+        active = active[split]
+    return points[keep]
+
+
+def parse_path_data(d, point_transform, flatten_tolerance, point_budget,
+                    strict=False):
+    # returns the list of subpaths of the path data d (see evaluate_path) and
+    # whether the points are control points for Smooth.Bezier
+    # the flatten_tolerance is given in Modelica coordinates, to which
+    # point_transform maps the points
+    commands, counts, values = tokenize_path(d)
+    if frozenset(commands) <= frozenset("MmLlHhVvZz"):
+        return evaluate_path(commands, counts, values, strict), False
+    if strict:
+        check_path_arities(commands, counts)
+    segments = path_segments(commands, counts, values)
+    points = None
+    if "Z" not in commands.upper():
+        # Smooth.Bezier would close polygons with a curve
+        points = quadratic_spline_points(segments)
+    if points is not None:
+        return [points], True
+    t = point_transform
+    scale = max(math.hypot(t.a, t.b), math.hypot(t.c, t.d))
+    tolerance = flatten_tolerance / scale if scale > 0 else 1
+    if len(segments) >= FLATTEN_BATCH_MIN:
+        try:
+            subpaths = flatten_segments(
+                segments, tolerance, point_budget, lazy_numpy()
+            )
+            return subpaths, False
+        except ImportError:
+            pass
+    return flatten_segments_scalar(segments, tolerance, point_budget), False
+
+
+def quantize_points(points, decimal_place=2):
+    # snaps a list of (x, y) tuples or an (N, 2) array to the precision of
+    # to_s and removes points that are redundant at this precision: repeated
+    # points and interior points on a straight line between their neighbors
+    # the result is a list of (x, y) pairs that to_s formats exactly like the
+    # original points
+    scale = 10.0 ** decimal_place
+    if isinstance(points, list):
+        grid = [
+            (round_to_grid(x, scale, math), round_to_grid(y, scale, math))
+            for x, y in points
+        ]
+        res = grid[:1]
+        for p in grid[1:]:
+            if p == res[-1]:
+                continue
+            if len(res) > 1 and continues_line(res[-2], res[-1], p):
+                res[-1] = p
+            else:
+                res.append(p)
+        return [(x / scale, y / scale) for x, y in res]
+    points, _ = quantize_point_buffer(points, [0, len(points)], decimal_place)
+    return points.tolist()
+
+
+def quantize_point_buffer(points, offsets, decimal_place=2):
+    # vectorized quantize_points for an (N, 2) array with the points of
+    # several paths, where path i consists of points[offsets[i]:offsets[i+1]]
+    # returns the quantized points and their offsets
+    np = lazy_numpy()
+    scale = 10.0 ** decimal_place
+    grid = round_to_grid(points, scale, np)
+    offsets = np.asarray(offsets, dtype=int)
+    for redundant in [repeated_points, straight_run_points]:
+        # starts[j] is true if point j is the first point of a path (or the
+        # end of the buffer)
+        starts = np.zeros(len(grid) + 1, dtype=bool)
+        starts[offsets] = True
+        keep = ~redundant(grid, starts, np)
+        grid = grid[keep]
+        offsets = np.concatenate([[0], np.cumsum(keep)])[offsets]
+    return grid / scale, offsets
+
+
+def repeated_points(grid, starts, np):
+    # points that equal their predecessor in the same path
+    res = np.zeros(len(grid), dtype=bool)
+    res[1:] = np.all(grid[1:] == grid[:-1], axis=1) & ~starts[1:-1]
+    return res
+
+
+def straight_run_points(grid, starts, np):
+    # interior points on a straight line between their neighbors in the same
+    # path (removing all of them at once is safe, since only points that do
+    # not reverse the direction are removed)
+    res = np.zeros(len(grid), dtype=bool)
+    if len(grid) > 2:
+        d1 = grid[1:-1] - grid[:-2]
+        d2 = grid[2:] - grid[1:-1]
+        cross = d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0]
+        dot = d1[:, 0] * d2[:, 0] + d1[:, 1] * d2[:, 1]
+        res[1:-1] = (cross == 0) & (dot > 0) & ~starts[1:-2] & ~starts[2:-1]
+    return res
+
+
+def round_to_grid(x, scale, lib):
+    # returns x * scale rounded to an integer (as float, keeping the sign of
+    # zero) exactly like the formatting in to_s, which rounds the exact
+    # decimal value of x half to even
+    # works with floats (lib = math) and numpy arrays (lib = numpy)
+    scaled = x * scale
+    low = lib.floor(scaled)
+    if lib is math:
+        high = math.ceil(scaled)
+        nearest = low if scaled - low < high - scaled else high
+        if scaled - low == 0.5:
+            nearest = low if low % 2 == 0 else high
+    else:
+        nearest = lib.rint(scaled)
+    # the product x * scale is rounded itself, so values that end up exactly
+    # between two grid points are decided by the rounding error
+    error = product_error(x, scale, scaled)
+    tie = scaled - low == 0.5
+    if lib is math:
+        if tie and error != 0:
+            nearest = low + (error > 0)
+    else:
+        nearest = lib.where(tie & (error > 0), low + 1, nearest)
+        nearest = lib.where(tie & (error < 0), low, nearest)
+    return lib.copysign(nearest, scaled)
+
+
+def product_error(a, b, product):
+    # exact rounding error of the floating point product a * b (Dekker)
+    def split(v):
+        c = 134217729.0 * v
+        high = c - (c - v)
+        return high, v - high
+    ah, al = split(a)
+    bh, bl = split(b)
+    return ((ah * bh - product) + ah * bl + al * bh) + al * bl
+
+
+def continues_line(a, b, c):
+    # true if b lies on the straight line from a to c between a and c
+    d1 = (b[0] - a[0], b[1] - a[1])
+    d2 = (c[0] - b[0], c[1] - b[1])
+    return (
+        d1[0] * d2[1] - d1[1] * d2[0] == 0
+        and d1[0] * d2[0] + d1[1] * d2[1] > 0
+    )
+
+
+def resolve_path_axis(start, values, indices, relative, np):
+    # returns the absolute coordinates along one axis for a sequence of
+    # segments that set (absolute), move (relative) or keep the coordinate
+    given = indices >= 0
+    # keeping a coordinate is treated as relative move by zero
+    vals = np.where(given, values[np.maximum(indices, 0)], 0.0)
+    absolute = given & ~relative
+    resets = np.flatnonzero(absolute)
+    n = len(vals)
+    res = vals.copy()
+    # every absolute coordinate starts a run of relative moves, which are
+    # accumulated with cumulative sums (in the same order as a sequential
+    # evaluation to obtain identical rounding)
+    first = resets[0] if len(resets) > 0 else n
+    if first > 0:
+        res[:first] = np.cumsum(np.concatenate([[start], vals[:first]]))[1:]
+    bounds = np.append(resets, n)
+    for i in np.flatnonzero(np.diff(bounds) > 1).tolist():
+        res[bounds[i]:bounds[i+1]] = np.cumsum(vals[bounds[i]:bounds[i+1]])
+    return res
+
+
 class ModelicaPath(ModelicaElement, GraphicItem):
-    def __init__(self, name, el, n_indent=3, coords=None, strict=False):
-        GraphicItem.__init__(self, coords)
+    __slots__ = ModelicaElement.SLOTS + (
+        "simplify", "point_counts", "flatten_tolerance", "point_budget"
+    )
+    PLAIN_VALUES = True
+
+    def __init__(
+            self, name, el, n_indent=3, coords=None, strict=False,
+            matrix=None, decomposition=None, style=None, simplify=0,
+            flatten_tolerance=0.1, point_budget=1000, row=None
+    ):
+        # tolerance for simplify_points (0 = no simplification)
+        self.simplify = simplify
+        self.point_counts = None
+        # settings for flatten_segments
+        self.flatten_tolerance = flatten_tolerance
+        self.point_budget = point_budget
+        GraphicItem.__init__(
+            self, coords, matrix=matrix, decomposition=decomposition,
+            style=style, row=row
+        )
         ModelicaElement.__init__(
             self, name, el, n_indent, coords=coords, strict=strict
         )
@@ -832,96 +3535,61 @@ class ModelicaPath(ModelicaElement, GraphicItem):
         self.autoset_points_and_smooth(el)
 
     def autoset_points_and_smooth(self, el):
-        d = el.get("d")
-        points = self.parse_path(d)
-        self.set_points(points)
-        smoothOps = frozenset("csqtaCSQTA")
-        self.set_smooth(len(frozenset(d) & smoothOps) > 0)
+        points = self.ir_column("points")
+        if points is not None:
+            # transformed and quantized by GraphicsIR.transform_paths
+            self.add_attribute("points", points)
+            return
+        parsed = self.ir_column("paths")
+        if parsed is None:
+            parsed = self.parse_path(el.get("d"))
+        subpaths, smooth = parsed
+        # the points of smooth lines are control points
+        self.set_points(subpaths, simplify=not smooth)
+        self.set_smooth(smooth)
 
     def parse_path(self, d):
-        exp = re.compile(r"([a-zA-Z]|(?:-?\d+(?:\.\d+)?(?:e\-?\d+)?))[\s,]*")
-
-        def float_or_self(x):
-            try:
-                return float(x)
-            except ValueError:
-                return x
-        tokens = [float_or_self(x) for x in exp.findall(d)]
-        points = []
-        i = 0
-        x = 0
-        y = 0
-        mode = "abs"
-        segtype = ""
-        width = 2
-        while i < len(tokens):
-            if isinstance(tokens[i], str):
-                segtype = tokens[i]
-                i += 1
-
-            if segtype == 'M':  # move to absolute
-                x = tokens[i]
-                y = tokens[i+1]
-                i += 2
-                segtype = 'L'
-            elif segtype == 'm':  # move to relative
-                x += tokens[i]
-                y += tokens[i+1]
-                i += 2
-                segtype = 'l'
-            elif segtype == 'L':  # line to absolute
-                if len(points) == 0:
-                    points.append([x, y])
-                x = tokens[i]
-                y = tokens[i+1]
-                points.append([x, y])
-                i += 2
-            elif segtype == 'l':  # line to relative
-                if len(points) == 0:
-                    points.append([x, y])
-                x += tokens[i]
-                y += tokens[i+1]
-                points.append([x, y])
-                i += 2
-            elif segtype == 'H':  # horizontal line to absolute
-                if len(points) == 0:
-                    points.append([x, y])
-                x = tokens[i]
-                points.append([x, y])
-                i += 1
-            elif segtype == 'h':  # horizontal line to relative
-                if len(points) == 0:
-                    points.append([x, y])
-                x += tokens[i]
-                points.append([x, y])
-                i += 1
-            elif segtype == 'V':  # vertical line to absolute
-                if len(points) == 0:
-                    points.append([x, y])
-                y = tokens[i]
-                points.append([x, y])
-                i += 1
-            elif segtype == 'v':  # vertical line to relative
-                if len(points) == 0:
-                    points.append([x, y])
-                y += tokens[i]
-                points.append([x, y])
-                i += 1
-            elif segtype in ['z', 'Z']:
-                pass
-            else:
-                # TODO handle smooth paths correctly (as far as possible)
-                # NOT SUPPORTED: smooth paths
-                if self.strict:
-                    raise MoNKError("{0} not supported!".format(tokens[i]))
-                # abandon path, since it will be messed up anyway
-                return []
-        return points
+        return parse_path_data(
+            d, self.point_transform, self.flatten_tolerance, self.point_budget,
+            self.strict
+        )
 
-    def set_points(self, points):
-        corrected = [[self.x_coord(x), self.y_coord(y)] for x, y in points]
-        formatted = ["{%s, %s}" % to_s(x, y) for x, y in corrected]
-        self.add_attribute("points", "{%s}" % ", ".join(formatted))
+    def set_points(self, subpaths, simplify=True):
+        # the subpaths are joined, since Modelica has no concept of subpaths
+        if simplify and self.simplify > 0:
+            corrected = self.simplified_points(subpaths)
+        elif len(subpaths) > 0 and not isinstance(subpaths[0], list):
+            corrected = self.transform_array(
+                lazy_numpy().concatenate(subpaths)
+            )
+        else:
+            corrected = [
+                p for points in subpaths
+                for p in self.transform_points(points)
+            ]
+        if simplify:
+            # control points of smooth lines must not be removed
+            corrected = quantize_points(corrected)
+        else:
+            corrected = [tuple(p) for p in corrected]
+        self.add_attribute("points", format_points(corrected))
+
+    def simplified_points(self, subpaths):
+        # the tolerance is given in Modelica coordinates, therefore the
+        # subpaths are simplified after the transformation
+        np = lazy_numpy()
+        subpaths = [
+            self.transform_array(np.asarray(points, dtype="float64"))
+            for points in subpaths
+        ]
+        before = sum(len(points) for points in subpaths)
+        subpaths = [
+            simplify_points(points, self.simplify, np) for points in subpaths
+        ]
+        self.point_counts = (before, sum(len(points) for points in subpaths))
+        if len(subpaths) == 0:
+            return []
+        return np.concatenate(subpaths)
 
     def set_smooth(self, isSmooth):
         if isSmooth:
@@ -929,9 +3597,21 @@ class ModelicaPath(ModelicaElement, GraphicItem):
 
 
 class ModelicaPolygon(ModelicaPath, FilledShape):
-    def __init__(self, el, n_indent=5, coords=None, strict=False):
+    FIELDS, FIELD_INDEX = record_fields(
+        "points", *MODELICA_DEFAULTS["Polygon"]
+    )
+    __slots__ = ()
+
+    def __init__(
+            self, el, n_indent=5, coords=None, strict=False, matrix=None,
+            decomposition=None, style=None, simplify=0,
+            flatten_tolerance=0.1, point_budget=1000, row=None
+    ):
         ModelicaPath.__init__(
-            self, "Polygon", el, n_indent, coords=coords, strict=strict
+            self, "Polygon", el, n_indent, coords=coords, strict=strict,
+            matrix=matrix, decomposition=decomposition, style=style,
+            simplify=simplify, flatten_tolerance=flatten_tolerance,
+            point_budget=point_budget, row=row
         )
 
     def add_attributes(self, el):
@@ -941,9 +3621,19 @@ class ModelicaPolygon(ModelicaPath, FilledShape):
 
 class ModelicaLine(ModelicaPath, FilledShape):
     # line is no filled shape, but we need some of the methods
-    def __init__(self, el, n_indent=5, coords=None, strict=False):
+    FIELDS, FIELD_INDEX = record_fields("points", *MODELICA_DEFAULTS["Line"])
+    __slots__ = ()
+
+    def __init__(
+            self, el, n_indent=5, coords=None, strict=False, matrix=None,
+            decomposition=None, style=None, simplify=0,
+            flatten_tolerance=0.1, point_budget=1000, row=None
+    ):
         ModelicaPath.__init__(
-            self, "Line", el, n_indent, coords=coords, strict=strict
+            self, "Line", el, n_indent, coords=coords, strict=strict,
+            matrix=matrix, decomposition=decomposition, style=style,
+            simplify=simplify, flatten_tolerance=flatten_tolerance,
+            point_budget=point_budget, row=row
         )
 
     def add_attributes(self, el):
@@ -970,8 +3660,8 @@ class ModelicaLine(ModelicaPath, FilledShape):
     def autoset_arrow(self, el):
         # if there is a marker, we just assume it's an arrow
         # TODO we might try to interpret some of the marker names from inkscape
-        arrow_s = get_style_attribute(el, "marker-start")
-        arrow_e = get_style_attribute(el, "marker-end")
+        arrow_s = self.get_style(el).get("marker-start")
+        arrow_e = self.get_style(el).get("marker-end")
         if arrow_s is not None or arrow_e is not None:
             self.set_arrow(arrow_s, arrow_e, self.find_line_thickness(el))
 
@@ -996,10 +3686,25 @@ class ModelicaLine(ModelicaPath, FilledShape):
 
 
 class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
+    FIELDS, FIELD_INDEX = record_fields(
+        "extent", "textColor", "textString", *MODELICA_DEFAULTS["Text"]
+    )
+    __slots__ = ModelicaElement.SLOTS + (
+        "font_size_mm", "stylesheet", "autoscale_font", "zero_width_extent",
+        "tspan_style"
+    )
+    PLAIN_VALUES = True
+
     def __init__(
-            self, el, n_indent=5, coords=None, strict=False, extent="normal"
+            self, el, n_indent=5, coords=None, strict=False, extent="normal",
+            matrix=None, decomposition=None, style=None, stylesheet=None,
+            row=None
     ):
         self.font_size_mm = None
+        # rules of <style> elements that apply to the tspan children
+        self.stylesheet = stylesheet
+        # computed css properties of the first tspan (see get_tspan_style)
+        self.tspan_style = None
         if extent == "normal":
             self.autoscale_font = False
             self.zero_width_extent = False
@@ -1013,7 +3718,10 @@ class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
             raise MoNKError(
                 "text extent mode {} not recognized".format(extent)
             )
-        GraphicItem.__init__(self, coords)
+        GraphicItem.__init__(
+            self, coords, matrix=matrix, decomposition=decomposition,
+            style=style, row=row
+        )
         ModelicaElement.__init__(
             self, "Text", el, n_indent, coords=coords, strict=strict
         )
@@ -1031,9 +3739,10 @@ class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
         # modelica uses the line color for text while SVG uses the fill color
         # => switch those
         self.autoset_fill_color(el)
-        if "fillColor" in self.data:
-            self.data["textColor"] = self.data["fillColor"]
-            del self.data["fillColor"]
+        fc = self.get_attribute("fillColor")
+        if fc is not None:
+            self.add_attribute("textColor", fc)
+            self.remove_attribute("fillColor")
 
     def autoset_text_string(self, el):
         if tn(el) == "tspan":
@@ -1045,13 +3754,30 @@ class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
             ])
         self.set_text_string(text)
 
-    def get_font(self, el):
-        if not isinstance(el, etree._Element):
-            return [None, None, None]
+    def release_conversion_state(self):
+        GraphicItem.release_conversion_state(self)
+        self.tspan_style = None
+
+    def get_tspan_style(self, el):
+        # computed css properties of the first child of the text element el,
+        # which inherits the properties of el
+        if self.tspan_style is None:
+            child = el.getchildren()[0]
+            if isinstance(child, etree._Element):
+                self.tspan_style = computed_style(
+                    child, inherited_style(self.get_style(el)),
+                    self.stylesheet
+                )
+            else:
+                self.tspan_style = EMPTY_STYLE
+        return self.tspan_style
+
+    def get_font(self, css):
+        # font name, size and style given by the css properties css
         style = ""
-        f_style = get_style_attribute(el, "font-style")
-        f_weight = get_style_attribute(el, "font-weight")
-        t_deco = get_style_attribute(el, "text-decoration")
+        f_style = css.get("font-style")
+        f_weight = css.get("font-weight")
+        t_deco = css.get("text-decoration")
         if f_style == "italic":
             style.append("i")
         if f_weight == "bold":
@@ -1061,14 +3787,14 @@ class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
         # distinguish between no attributes given and all set to normal
         if f_style is None and f_weight is None and t_deco is None:
             style = None
-        fontName = get_style_attribute(el, "font-family")
-        fontSize = get_style_attribute(el, "font-size")
+        fontName = css.get("font-family")
+        fontSize = css.get("font-size")
         return fontName, self.to_pt(fontSize), style
 
     def to_pt(self, size_str):
         if size_str is None:
             return None
-        exp_match = re.match(r"(-?\d+\.?\d*)([a-zA-Z]*)", size_str)
+        exp_match = re_size.match(size_str)
         if exp_match is None:
             raise ValueError("cannot understand size {0}".format(size_str))
         # modelica coordinates are assumed to be in mm, so we set 1px = 1mm
@@ -1077,8 +3803,10 @@ class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
         return transform_units(float(number), unit, "pt")
 
     def autoset_font(self, el):
-        outerName, outerSize, outerStyle = self.get_font(el)
-        innerName, innerSize, innerStyle = self.get_font(el.getchildren()[0])
+        outerName, outerSize, outerStyle = self.get_font(self.get_style(el))
+        innerName, innerSize, innerStyle = self.get_font(
+            self.get_tspan_style(el)
+        )
         fontSize = innerSize or outerSize or 0
         self.font_size_mm = transform_units(fontSize, "pt", "mm")
         if self.autoscale_font:
@@ -1095,7 +3823,7 @@ class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
         # TODO can we do better for the extent? probably not without rendering
         # the text element
         # determine text width and height in number of characters
-        text = eval(self.data["textString"])
+        text = eval(self.get_attribute("textString"))
         text_w = max([len(s) for s in text.split("\n")])
         text_h = len(text.split("\n"))
         # guess how much pixels (or mm) that would be based on font_size
@@ -1109,7 +3837,7 @@ class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
         h = text_h * line_height \
             + text_h * self.font_size_mm * 0.2  # 1.2 line spacing
         baseline_rel = 0.1  # relative position of baseline within line_height
-        ha = self.data["horizontalAlignment"]
+        ha = self.get_attribute("horizontalAlignment")
         if self.zero_width_extent:
             # TODO Modelica spec says that alignment must still be respected
             # but OpenModelica does not seem to do so? => stick with OM for now
@@ -1132,19 +3860,16 @@ class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
             y1 = y - w/2 + baseline_rel * line_height
             x2 = x + w/2
             y2 = y + w/2 + baseline_rel * line_height
-        self.set_extent(
-            self.x_coord(x1), self.y_coord(y1),
-            self.x_coord(x2), self.y_coord(y2)
-        )
+        self.set_extent(*self.transform_extent(x1, y1, x2, y2))
 
     def autoset_horizontal_alignment(self, el):
         # first try: text-align attribute in <text> element
-        alignOuter = get_style_attribute(el, "text-align")
+        alignOuter = self.get_style(el).get("text-align")
         # override option: text-anchor attribute in <tspan> element
         anchor_to_align = {
             "start": "left", "end": "right", "middle": "center"
         }
-        alignInner = get_style_attribute(el.getchildren()[0], "text-anchor")
+        alignInner = self.get_tspan_style(el).get("text-anchor")
         if alignInner is not None:
             alignInner = anchor_to_align[alignInner]
         align = alignInner or alignOuter or "left"
@@ -1153,7 +3878,7 @@ class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
 
     def set_extent(self, x1, y1, x2, y2):
         self.add_attribute(
-            "extent", "{{%s,%s},{%s,%s}}" % to_s(x1, y1, x2, y2)
+            "extent", format_numbers("{{%s,%s},{%s,%s}}", [x1, y1, x2, y2])
         )
 
     def set_text_string(self, s):
@@ -1196,34 +3921,252 @@ class ModelicaText(ModelicaElement, GraphicItem, FilledShape):
         return True
 
 
-if __name__ == '__main__':
+USAGE = (
+    "usage: python svg2modelica.py [-m modelname] [-s true/false] "
+    + "[-n true/false] [-t normal/scaled/flow] "
+    + "[--streaming=true/false] [--simplify=tolerance]\n"
+    + "       [--flatten_tolerance=tolerance] [--point_budget=points] "
+    + "[--compact=true/false] [-j jobs] [-o output] filename\n"
+    + "       python svg2modelica.py --batch=true [-j jobs] "
+    + "[-o outdir] [options] dir_or_pattern...\n"
+    + "       python svg2modelica.py --daemon=true [--socket=path] [options]\n"
+    + "cache options: [--cache_dir=dir] [--cache_size=megabytes] "
+    + "[--use_cache=true/false] [--clear_cache=true/false]"
+)
+
+
+def number_option(k, v, convert):
+    # value of the numeric command line option k
     try:
-        opts, args = getopt.getopt(
-            sys.argv[1:], "m:s:n:t:",
-            ["modelname=", "strict=", "normalize_extent=", "text_extent="]
+        return convert(v)
+    except ValueError:
+        raise getopt.GetoptError(
+            "invalid value {} for option {}".format(v, k), k
         )
-    except getopt.GetoptError as err:
-        print(str(err))
-        print(
-            "usage: python svg2modelica.py [-m modelname] [-s true/false] "
-            + "[-n true/false] [-t normal/scaled/flow] filename"
-        )
-        exit(1)
-    strict = False
-    modelname = "DummyModel"
-    norm_extent = False
-    text_extent = "normal"
+
+
+def parse_args(argv, environ=os.environ):
+    # returns keyword arguments for convert_svg, settings for the mode of
+    # operation (batch, daemon) and the remaining positional arguments;
+    # environ holds the environment variables of the caller
+    opts, args = getopt.getopt(
+        argv, "m:s:n:t:j:o:",
+        [
+            "modelname=", "strict=", "normalize_extent=", "text_extent=",
+            "streaming=", "batch=", "jobs=", "output=", "outdir=", "daemon=",
+            "socket=",
+            "cache_dir=", "cache_size=", "use_cache=", "clear_cache=",
+            "simplify=", "flatten_tolerance=", "point_budget=", "compact="
+        ]
+    )
+    options = {
+        "modelname": "DummyModel", "strict": False, "normalize_extent": False,
+        "text_extent": "normal", "streaming": False, "simplify": 0,
+        "flatten_tolerance": 0.1, "point_budget": 1000, "compact": False
+    }
+    mode = {
+        "batch": False, "jobs": None, "output": None, "daemon": False,
+        "socket": None, "cache_dir": environ.get("MONK_CACHE_DIR"),
+        "cache_size": 100, "use_cache": True, "clear_cache": False
+    }
     for k, v in opts:
         if k in ("-s", "--strict"):
-            strict = v in ["true", "True"]
+            options["strict"] = v in ["true", "True"]
         elif k in ("-m", "--modelname"):
-            modelname = v
+            options["modelname"] = v
         elif k in ("-n", "--normalize_extent"):
-            norm_extent = v in ["true", "True"]
+            options["normalize_extent"] = v in ["true", "True"]
         elif k in ("-t", "--text_extent"):
-            text_extent = v
-    fname = args[0]
-    parse_svg(
-        fname, modelname, strict=strict, normalize_extent=norm_extent,
-        text_extent=text_extent
+            options["text_extent"] = v
+        elif k == "--streaming":
+            options["streaming"] = v in ["true", "True"]
+        elif k == "--simplify":
+            options["simplify"] = number_option(k, v, float)
+            if not options["simplify"] >= 0:
+                raise getopt.GetoptError("--simplify must not be negative", k)
+        elif k == "--flatten_tolerance":
+            options["flatten_tolerance"] = number_option(k, v, float)
+            if not options["flatten_tolerance"] > 0:
+                raise getopt.GetoptError(
+                    "--flatten_tolerance must be positive", k
+                )
+        elif k == "--point_budget":
+            options["point_budget"] = number_option(k, v, int)
+            if options["point_budget"] < 0:
+                raise getopt.GetoptError(
+                    "--point_budget must not be negative", k
+                )
+        elif k == "--compact":
+            options["compact"] = v in ["true", "True"]
+        elif k == "--batch":
+            mode["batch"] = v in ["true", "True"]
+        elif k in ("-j", "--jobs"):
+            mode["jobs"] = number_option(k, v, int)
+        elif k in ("-o", "--output", "--outdir"):
+            # output file or, in batch mode, output directory
+            mode["output"] = v
+        elif k == "--daemon":
+            mode["daemon"] = v in ["true", "True"]
+        elif k == "--socket":
+            mode["socket"] = v
+        elif k == "--cache_dir":
+            mode["cache_dir"] = v
+        elif k == "--cache_size":
+            mode["cache_size"] = number_option(k, v, float)
+        elif k == "--use_cache":
+            mode["use_cache"] = v in ["true", "True"]
+        elif k == "--clear_cache":
+            mode["clear_cache"] = v in ["true", "True"]
+    return options, mode, args
+
+
+def create_cache(mode):
+    if mode["cache_dir"] is None:
+        return None
+    cache = ConversionCache(
+        mode["cache_dir"], max_size=int(mode["cache_size"] * 1024 * 1024)
+    )
+    if mode["clear_cache"]:
+        cache.clear()
+    return cache if mode["use_cache"] else None
+
+
+def handle_daemon_request(req, element_cache=None):
+    # answers a request of svg2modelica_client.py; requests that are not
+    # plain single file conversions are handed back to the client
+    # the cache settings are those of the client, not of the daemon
+    try:
+        options, mode, args = parse_args(
+            req["argv"], req.get("env", os.environ)
+        )
+    except getopt.GetoptError:
+        return {"fallback": True}
+    if mode["batch"] or mode["daemon"] or len(args) != 1:
+        return {"fallback": True}
+    if mode["output"] is not None:
+        # the client cannot write files on behalf of the daemon
+        return {"fallback": True}
+    fname = os.path.join(req["cwd"], args[0])
+    if mode["cache_dir"] is not None:
+        mode["cache_dir"] = os.path.join(req["cwd"], mode["cache_dir"])
+    try:
+        options["cache"] = create_cache(mode)
+        options["element_cache"] = element_cache
+        return {"output": convert_svg(fname, **options), "error": None}
+    except MoNKError as e:
+        return {"output": None, "error": "MoNKError: " + e.msg}
+    except Exception as e:
+        return {
+            "output": None, "error": "{}: {}".format(type(e).__name__, e)
+        }
+
+
+def serve(socket_path=None):
+    # long-lived conversion daemon listening on a unix domain socket, which
+    # saves the startup time of python, lxml and numpy for every conversion
+    import signal
+    import socket
+    import stat
+    from svg2modelica_client import (
+        default_socket_path, owned_by_us, private_socket_dir, recv_all
     )
+    path = socket_path or default_socket_path()
+    directory = os.path.dirname(path)
+    if directory == private_socket_dir():
+        try:
+            os.mkdir(directory, 0o700)
+        except OSError:
+            pass  # already created by us (or by someone else, see below)
+        st = os.lstat(directory)
+        if (
+            not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid()
+            or st.st_mode & 0o077
+        ):
+            raise MoNKError(
+                "socket directory {} is accessible by other users".format(
+                    directory
+                )
+            )
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if os.path.exists(path):
+        if not owned_by_us(path):
+            raise MoNKError("socket {} belongs to another user".format(path))
+        try:
+            server.connect(path)
+        except socket.error:
+            # stale socket of a daemon that was killed
+            os.remove(path)
+        else:
+            server.close()
+            raise MoNKError("daemon already running at {}".format(path))
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the socket must never be accessible by other users, not even between
+    # bind and chmod
+    umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    os.chmod(path, 0o600)
+    server.listen(5)
+    # elements of the previous conversions stay in memory, so that saving
+    # a document again only needs to convert the elements that changed
+    element_cache = ElementCache()
+    # turn SIGTERM into SystemExit so that the socket file is cleaned up
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                req = json.loads(recv_all(conn).decode("utf-8"))
+                res = handle_daemon_request(req, element_cache)
+                conn.sendall(json.dumps(res).encode("utf-8"))
+            except Exception as e:
+                # a broken request must not take down the daemon
+                sys.stderr.write("{}: {}\n".format(type(e).__name__, e))
+            finally:
+                conn.close()
+    finally:
+        server.close()
+        os.remove(path)
+
+
+def main(argv):
+    try:
+        options, mode, args = parse_args(argv)
+    except getopt.GetoptError as err:
+        print(str(err))
+        print(USAGE)
+        return 1
+    if mode["daemon"]:
+        serve(mode["socket"])
+        return 0
+    options["cache"] = create_cache(mode)
+    if len(args) == 0 and mode["clear_cache"]:
+        return 0  # only clear the cache
+    if mode["batch"]:
+        del options["modelname"]  # batch mode uses file names
+        n, errors = batch_convert(
+            args, outdir=mode["output"], jobs=mode["jobs"], **options
+        )
+        for fname, msg in errors:
+            sys.stderr.write("{}: {}\n".format(fname, msg))
+        sys.stderr.write("converted {} of {} files\n".format(
+            n - len(errors), n
+        ))
+        return 1 if len(errors) > 0 else 0
+    if mode["jobs"] is not None:
+        # parallel conversion of a single document
+        options["jobs"] = mode["jobs"]
+    if options["cache"] is not None:
+        ecache_path = options["cache"].element_cache_path()
+        options["element_cache"] = ElementCache().load(ecache_path)
+        parse_svg(args[0], output=mode["output"], **options)
+        options["element_cache"].save(ecache_path)
+    else:
+        parse_svg(args[0], output=mode["output"], **options)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
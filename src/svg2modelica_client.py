@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# Thin client for the conversion daemon (svg2modelica.py --daemon=true).
+# This script only imports lightweight modules from the standard library, so
+# that it starts quickly. If no daemon is running, the conversion is done
+# in-process by svg2modelica.py instead.
+
+import json
+import os
+import socket
+import sys
+
+
+def default_socket_path():
+    path = os.environ.get("MONK_SOCKET")
+    if path is None:
+        uid = os.getuid() if hasattr(os, "getuid") else 0
+        tmp = os.environ.get("XDG_RUNTIME_DIR")
+        if tmp:
+            path = os.path.join(tmp, "monk-{}.sock".format(uid))
+        else:
+            # /tmp is shared with other users, so the socket is placed in a
+            # directory that only we can access (created by the daemon)
+            path = os.path.join(private_socket_dir(), "monk.sock")
+    return path
+
+
+def private_socket_dir():
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return os.path.join("/tmp", "monk-{}".format(uid))
+
+
+def owned_by_us(path):
+    # false if path belongs to another user, who could forge the output of
+    # the daemon
+    if not hasattr(os, "getuid"):
+        return True
+    try:
+        return os.stat(path).st_uid == os.getuid()
+    except OSError:
+        return False
+
+
+def recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def request_conversion(argv, socket_path=None):
+    # returns the response of the daemon or None if no daemon is listening
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        path = socket_path or default_socket_path()
+        if not owned_by_us(path):
+            return None
+        try:
+            sock.connect(path)
+        except socket.error:
+            return None
+        # the daemon uses the cache directory of the client
+        env = {}
+        if "MONK_CACHE_DIR" in os.environ:
+            env["MONK_CACHE_DIR"] = os.environ["MONK_CACHE_DIR"]
+        req = {"cwd": os.getcwd(), "argv": argv, "env": env}
+        sock.sendall(json.dumps(req).encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+        return json.loads(recv_all(sock).decode("utf-8"))
+    finally:
+        sock.close()
+
+
+def write_utf8(stream, s):
+    getattr(stream, "buffer", stream).write(s.encode("utf-8"))
+    stream.flush()
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    res = request_conversion(argv)
+    if res is None or res.get("fallback", False):
+        import svg2modelica
+        sys.exit(svg2modelica.main(argv))
+    if res["error"] is not None:
+        write_utf8(sys.stderr, res["error"] + "\n")
+        sys.exit(1)
+    write_utf8(sys.stdout, res["output"] + "\n")
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+# Benchmarks for svg2modelica.py (not run as part of the unit tests).
+#
+# usage: python test/benchmarks.py BENCHMARK [other_svg2modelica.py ...]
+#
+# Available benchmarks:
+#
+# startup    import time and total time of a conversion in a fresh process
+# transform  time per element for determining and decomposing the
+#            transformation matrix (in microseconds)
+# primitives time for converting and for writing a document with 100k
+#            primitives and memory per converted primitive
+#
+# Paths to additional versions of svg2modelica.py can be given to compare them
+# against the current one (e.g. a file obtained with
+# `git show v0.2.0:src/svg2modelica.py > /tmp/old/svg2modelica.py`).
+
+import os
+import pathlib
+import re
+import subprocess
+import sys
+import time
+
+SRC = pathlib.Path(__file__).parents[1] / "src" / "svg2modelica.py"
+EXAMPLE = pathlib.Path(__file__).parents[1] / "examples" / "all_primitives.svg"
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def import_times(script):
+    # runs `python -X importtime` and returns the cumulative import time in
+    # microseconds of the module itself and of its top-level dependencies
+    res = subprocess.run(
+        [
+            sys.executable, "-X", "importtime", "-c",
+            "import " + script.stem
+        ],
+        cwd=str(script.parent), stderr=subprocess.PIPE, check=True,
+        universal_newlines=True
+    )
+    times = {}
+    deps = {}
+    for line in res.stderr.splitlines():
+        m = re.match(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|( *)(\S+)", line)
+        if m is None:
+            continue
+        # children are listed before their parent and indented by two more
+        # spaces, direct imports of the script are therefore indented by 3
+        if len(m.group(2)) == 3:
+            deps[m.group(3)] = int(m.group(1))
+        elif len(m.group(2)) == 1:
+            if m.group(3) == script.stem:
+                times.update(deps)
+                times[script.stem] = int(m.group(1))
+            deps = {}
+    return times
+
+
+def conversion_time(script, repeat):
+    # median wall time of a complete conversion in a fresh process
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(script), str(EXAMPLE)],
+            stdout=subprocess.DEVNULL, check=True
+        )
+        durations.append(time.perf_counter() - start)
+    return median(durations)
+
+
+# runs in a separate process with the directory of the script as working
+# directory, so that different versions of the module can be compared
+TRANSFORM_BENCHMARK = """
+import timeit
+import lxml.etree as etree
+import svg2modelica as s2m
+
+root = etree.Element("svg")
+leaves = []
+for i in range(100):
+    # single transforms per element, which all versions can handle
+    g = etree.SubElement(
+        root, "g", transform="translate({0},{1})".format(i, 2 * i)
+    )
+    g = etree.SubElement(g, "g", transform="rotate({0})".format(i))
+    leaves.append(etree.SubElement(g, "rect", transform="rotate(30)"))
+item = s2m.GraphicItem(None)
+item.strict = True
+
+
+def run():
+    for el in leaves:
+        item.decompose_matrix(item.get_matrix(el))
+
+
+print(min(timeit.repeat(run, number=%(number)d, repeat=5)) / %(number)d / 100)
+"""
+
+
+def bench_transform(scripts, number=100):
+    print("{:<40} {:>16}".format("script", "per element [us]"))
+    for script in scripts:
+        res = subprocess.run(
+            [
+                sys.executable, "-c",
+                TRANSFORM_BENCHMARK % {"number": number}
+            ],
+            cwd=str(script.parent), stdout=subprocess.PIPE, check=True,
+            universal_newlines=True
+        )
+        print("{:<40} {:>16.2f}".format(
+            str(script)[-40:], float(res.stdout) * 1e6
+        ))
+
+
+# runs in a separate process like TRANSFORM_BENCHMARK
+PRIMITIVES_BENCHMARK = """
+import gc
+import time
+import tracemalloc
+import lxml.etree as etree
+import svg2modelica as s2m
+
+SHAPES = [
+    '<rect x="{0}" y="{1}" width="3" height="2"'
+    ' style="fill:#ff0000;stroke:#000000;stroke-width:0.5"/>',
+    '<circle cx="{0}" cy="{1}" r="2" style="fill:#00ff00;stroke:none"/>',
+    '<path d="M {0},{1} L {2},{1} L {0},{3} Z"'
+    ' style="fill:#0000ff;stroke:#000000;stroke-width:1"/>',
+    '<path d="M {0},{1} L {2},{3}"'
+    ' style="fill:none;stroke:#ff00ff;stroke-width:1"/>',
+]
+
+
+def document(n):
+    shapes = "".join(
+        SHAPES[i %% 4].format(i %% 1000, i // 100, i %% 1000 + 3, i // 100 + 3)
+        for i in range(n)
+    )
+    return etree.ElementTree(etree.fromstring((
+        '<svg xmlns="http://www.w3.org/2000/svg" width="1000"'
+        ' height="1000">' + shapes + '</svg>'
+    ).encode("utf-8")))
+
+
+n = %(number)d
+doc = document(n)
+# lazy imports and caches
+str(s2m.ModelicaIcon(document(100)))
+gc.collect()
+start = time.perf_counter()
+icon = s2m.ModelicaIcon(doc)
+convert = time.perf_counter() - start
+start = time.perf_counter()
+str(icon)
+write = time.perf_counter() - start
+del icon
+gc.collect()
+tracemalloc.start()
+icon = s2m.ModelicaIcon(doc)
+print(convert, write, tracemalloc.get_traced_memory()[0] / n)
+"""
+
+
+def bench_primitives(scripts, number=100000):
+    print("{:<40} {:>12} {:>12} {:>16}".format(
+        "script", "convert [s]", "write [s]", "per element [B]"
+    ))
+    for script in scripts:
+        res = subprocess.run(
+            [
+                sys.executable, "-c",
+                PRIMITIVES_BENCHMARK % {"number": number}
+            ],
+            cwd=str(script.parent), stdout=subprocess.PIPE, check=True,
+            universal_newlines=True
+        )
+        convert, write, memory = [float(x) for x in res.stdout.split()]
+        print("{:<40} {:>12.2f} {:>12.2f} {:>16.0f}".format(
+            str(script)[-40:], convert, write, memory
+        ))
+
+
+def bench_startup(scripts, repeat=15):
+    print("{:<40} {:>12} {:>12}  {}".format(
+        "script", "import [ms]", "total [ms]", "slowest imports"
+    ))
+    for script in scripts:
+        times = [import_times(script) for _ in range(repeat)]
+        own = median([t[script.stem] for t in times])
+        deps = sorted(
+            [
+                (median([t.get(k, 0) for t in times]), k)
+                for k in times[0] if k != script.stem
+            ],
+            reverse=True
+        )[:3]
+        print("{:<40} {:>12.1f} {:>12.1f}  {}".format(
+            str(script)[-40:], own / 1000.0,
+            conversion_time(script, repeat) * 1000,
+            ", ".join("{} {:.1f}".format(k, v / 1000.0) for v, k in deps)
+        ))
+
+
+BENCHMARKS = {
+    "primitives": bench_primitives, "startup": bench_startup,
+    "transform": bench_transform
+}
+
+
+if __name__ == "__main__":
+    os.chdir(str(pathlib.Path(__file__).parents[1]))
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(
+            "usage: python test/benchmarks.py {} [svg2modelica.py ...]"
+            .format("|".join(sorted(BENCHMARKS)))
+        )
+        sys.exit(1)
+    others = [pathlib.Path(x).resolve() for x in sys.argv[2:]]
+    BENCHMARKS[sys.argv[1]]([SRC.resolve()] + others)
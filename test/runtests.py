@@ -4,7 +4,11 @@ import unittest
 import subprocess
 import pathlib
 import os
+import re
 import io
+import shutil
+import tempfile
+import time
 
 # TODO implement smaller test cases
 
@@ -18,11 +22,12 @@ class TestSvg2Modelica(unittest.TestCase):
     def setUp(self):
         self.maxDiff = None  # allow large string diffs
 
-    def get_expected_and_actual(self, fname):
-        res = subprocess.check_output([
-            "python", "src/svg2modelica.py", "--strict=true",
-            str(pathlib.Path("examples") / (fname + ".svg"))
-        ])
+    def get_expected_and_actual(self, fname, *options):
+        res = subprocess.check_output(
+            ["python", "src/svg2modelica.py", "--strict=true"]
+            + list(options)
+            + [str(pathlib.Path("examples") / (fname + ".svg"))]
+        )
         expected = ""
         fexp = pathlib.Path("examples") / (fname + "_expected.mo")
         with io.open(str(fexp), "r", encoding="utf-8") as f:
@@ -37,6 +42,460 @@ class TestSvg2Modelica(unittest.TestCase):
         act, exp = self.get_expected_and_actual("group_transform")
         self.assertEqualStdout(exp, act)
 
+    def test_transform_list(self):
+        act, exp = self.get_expected_and_actual("transform_list")
+        self.assertEqualStdout(exp, act)
+
+    def test_path_data(self):
+        act, exp = self.get_expected_and_actual("path_data")
+        self.assertEqualStdout(exp, act)
+
+    def test_style_inheritance(self):
+        act, exp = self.get_expected_and_actual("style_inheritance")
+        self.assertEqualStdout(exp, act)
+
+    def test_colors(self):
+        act, exp = self.get_expected_and_actual("colors")
+        self.assertEqualStdout(exp, act)
+
+    def test_tspan_style(self):
+        act, exp = self.get_expected_and_actual("tspan_style")
+        self.assertEqualStdout(exp, act)
+
+    def test_stylesheet(self):
+        for options in [[], ["--streaming=true"]]:
+            act, exp = self.get_expected_and_actual("stylesheet", *options)
+            self.assertEqualStdout(exp, act)
+
+    def test_use(self):
+        act, exp = self.get_expected_and_actual("use")
+        self.assertEqualStdout(exp, act)
+
+    def test_use_warnings(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fsvg = pathlib.Path(tmpdir) / "use_cycle.svg"
+            rect = (
+                '<rect x="{}" y="1" width="2" height="2"'
+                ' style="fill:#ff0000;stroke:none"/>'
+            )
+            with io.open(str(fsvg), "wb") as f:
+                f.write((
+                    '<svg xmlns="http://www.w3.org/2000/svg" width="100"'
+                    ' height="100"><g id="a">' + rect.format(1)
+                    + '<use href="#a" x="5"/></g><g id="b">' + rect.format(10)
+                    + '<use href="#c" x="5"/></g><g id="c">' + rect.format(20)
+                    + '<use href="#b" x="5"/></g></svg>'
+                ).encode("utf-8"))
+            # a and the outer b and c are converted once, b and c are also
+            # instantiated once in each other
+            for options, n, warning in [
+                ([], 5, "skipped cyclic reference #a"),
+                (["--streaming=true"], 3, "skipped 3 <use> elements")
+            ]:
+                proc = subprocess.Popen(
+                    ["python", "src/svg2modelica.py"] + options + [str(fsvg)],
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                )
+                out, err = proc.communicate()
+                self.assertEqual(0, proc.returncode)
+                self.assertEqual(n, out.decode("utf-8").count("Rectangle("))
+                self.assertIn(warning, err.decode("utf-8"))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_curves(self):
+        act, exp = self.get_expected_and_actual("curves")
+        self.assertEqualStdout(exp, act)
+
+    def test_many_curves(self):
+        # paths with many segments are flattened with numpy, which must give
+        # the same points as flattening each curve alone without numpy
+        tmpdir = tempfile.mkdtemp()
+        try:
+            curves = [
+                "C {0},8 {1},8 {1},0".format(10 * k, 10 * k + 10)
+                if k % 2 == 0 else
+                "A 5,3 0 0 1 {},0".format(10 * k + 10)
+                for k in range(70)
+            ]
+            paths = ["M 0,0 " + " ".join(curves)] + [
+                "M {},0 {}".format(10 * k, c) for k, c in enumerate(curves)
+            ]
+            fsvg = pathlib.Path(tmpdir) / "curves.svg"
+            with io.open(str(fsvg), "wb") as f:
+                f.write((
+                    '<svg xmlns="http://www.w3.org/2000/svg" width="700"'
+                    ' height="100">' + "".join(
+                        '<path d="{}" style="fill:none;stroke:#000000;'
+                        'stroke-width:1"/>'.format(d) for d in paths
+                    ) + '</svg>'
+                ).encode("utf-8"))
+            res = subprocess.check_output(
+                ["python", "src/svg2modelica.py", "--strict=true",
+                 "--point_budget=0", str(fsvg)]
+            ).decode("utf-8")
+            points = [
+                re.findall(r"\{([^{}]*)\}", p)
+                for p in re.findall(r"points= \{(.*?)\},?\n", res)
+            ]
+            self.assertEqual(71, len(points))
+            joined = points[1][:1] + [p for c in points[1:] for p in c[1:]]
+            self.assertEqual(joined, points[0])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_redundant_points(self):
+        act, exp = self.get_expected_and_actual("redundant_points")
+        self.assertEqualStdout(exp, act)
+
+    def test_compact(self):
+        act, _ = self.get_expected_and_actual(
+            "all_primitives", "--compact=true"
+        )
+        fexp = pathlib.Path("examples") / "all_primitives_compact_expected.mo"
+        with io.open(str(fexp), "r", encoding="utf-8") as f:
+            exp = f.read()
+        self.assertEqualStdout(exp, act)
+
+    def test_simplify(self):
+        fsvg = pathlib.Path("examples") / "path_data.svg"
+        proc = subprocess.Popen(
+            ["python", "src/svg2modelica.py", "--strict=true",
+             "--simplify=0.5", str(fsvg)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        act, err = proc.communicate()
+        fexp = pathlib.Path("examples") / "path_data_simplified_expected.mo"
+        with io.open(str(fexp), "r", encoding="utf-8") as f:
+            exp = f.read()
+        self.assertEqualStdout(exp, act.decode("utf-8"))
+        self.assertIn("from 920 to 320 points", err.decode("utf-8"))
+
+    def test_invalid_options(self):
+        fsvg = pathlib.Path("examples") / "curves.svg"
+        for option in ["--flatten_tolerance=0", "--flatten_tolerance=-1",
+                       "--point_budget=-1", "--simplify=-0.5",
+                       "--simplify=abc", "--flatten_tolerance=x",
+                       "--point_budget=1.5", "--jobs=x", "--cache_size=x"]:
+            proc = subprocess.Popen(
+                ["python", "src/svg2modelica.py", option, str(fsvg)],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            out, err = proc.communicate()
+            self.assertNotEqual(0, proc.returncode)
+            self.assertIn(option.split("=")[0], out.decode("utf-8"))
+            self.assertNotIn("Traceback", err.decode("utf-8"))
+
+    def test_streaming(self):
+        for fname in ["all_primitives", "group_transform", "transform_list"]:
+            act, exp = self.get_expected_and_actual(
+                fname, "--streaming=true"
+            )
+            self.assertEqualStdout(exp, act)
+
+    def test_output_file(self):
+        outdir = tempfile.mkdtemp()
+        try:
+            fout = pathlib.Path(outdir) / "group_transform.mo"
+            for options in [[], ["--streaming=true"]]:
+                subprocess.check_call(
+                    ["python", "src/svg2modelica.py", "--strict=true",
+                     "-o", str(fout)] + options
+                    + [str(pathlib.Path("examples") / "group_transform.svg")]
+                )
+                with io.open(str(fout), "r", encoding="utf-8") as f:
+                    act = f.read()
+                fexp = pathlib.Path("examples") / "group_transform_expected.mo"
+                with io.open(str(fexp), "r", encoding="utf-8") as f:
+                    exp = f.read()
+                self.assertEqualStdout(exp, act)
+            self.assertEqual(["group_transform.mo"], os.listdir(outdir))
+        finally:
+            shutil.rmtree(outdir)
+
+    def test_batch(self):
+        outdir = tempfile.mkdtemp()
+        try:
+            subprocess.check_call([
+                "python", "src/svg2modelica.py", "--batch=true",
+                "--strict=true", "--jobs=2", "--outdir=" + outdir,
+                str(pathlib.Path("examples") / "*.svg")
+            ])
+            for fname in ["all_primitives", "group_transform"]:
+                fact = pathlib.Path(outdir) / (fname + ".mo")
+                with io.open(str(fact), "r", encoding="utf-8") as f:
+                    act = f.read().replace(fname, "DummyModel")
+                fexp = pathlib.Path("examples") / (fname + "_expected.mo")
+                with io.open(str(fexp), "r", encoding="utf-8") as f:
+                    exp = f.read()
+                self.assertEqualStdout(exp, act)
+        finally:
+            shutil.rmtree(outdir)
+
+    def test_batch_subdirectories(self):
+        # files with the same name in different directories get their own
+        # output files and file names are turned into valid model names
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fsvg = pathlib.Path("examples") / "group_transform.svg"
+            indir = pathlib.Path(tmpdir) / "in"
+            for sub in ["a", "b"]:
+                os.makedirs(str(indir / sub))
+                shutil.copy(str(fsvg), str(indir / sub / "my-icon 2.svg"))
+            outdir = pathlib.Path(tmpdir) / "out"
+            subprocess.check_call([
+                "python", "src/svg2modelica.py", "--batch=true",
+                "--strict=true", "--jobs=2", "--outdir=" + str(outdir),
+                str(indir / "*" / "*.svg")
+            ])
+            fexp = pathlib.Path("examples") / "group_transform_expected.mo"
+            with io.open(str(fexp), "r", encoding="utf-8") as f:
+                exp = f.read().replace("DummyModel", "my_icon_2")
+            for sub in ["a", "b"]:
+                fact = outdir / sub / "my-icon 2.mo"
+                with io.open(str(fact), "r", encoding="utf-8") as f:
+                    self.assertEqualStdout(exp, f.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_batch_decomposition(self):
+        # enough elements to decompose their matrices in a vectorized batch,
+        # including matrices that scale the elements to nothing
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for transform in ["rotate(30) scale(-1,2)", "scale(0)",
+                              "rotate(30) scale(0,1)"]:
+                rect = (
+                    '<g transform="{}"><rect x="1" y="2" width="3"'
+                    ' height="4" transform="translate(5)"'
+                    ' style="fill:#ff0000;stroke:none"/></g>'
+                ).format(transform)
+                results = []
+                for n in [1, 200]:
+                    fsvg = pathlib.Path(tmpdir) / "rects{}.svg".format(n)
+                    with io.open(str(fsvg), "wb") as f:
+                        f.write((
+                            '<svg xmlns="http://www.w3.org/2000/svg"'
+                            ' width="100" height="100">' + rect * n
+                            + '</svg>'
+                        ).encode("utf-8"))
+                    res = subprocess.check_output(
+                        ["python", "src/svg2modelica.py", "--strict=true",
+                         str(fsvg)]
+                    ).decode("utf-8")
+                    results.append(res.split("Rectangle(")[1:])
+                self.assertEqual(200, len(results[1]))
+                single = results[0][0].split(")")[0]
+                for r in results[1]:
+                    self.assertEqual(single, r.split(")")[0])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_batch_geometry(self):
+        # the geometry of large batches is computed for all elements at once,
+        # which must give the same result as converting each element alone
+        tmpdir = tempfile.mkdtemp()
+        shapes = [
+            '<rect x="1" y="2" width="3" height="4"'
+            ' style="fill:#ff0000;stroke:#000000;stroke-width:0.5"/>',
+            '<circle cx="1" cy="2" r="3" style="fill:#00ff00;stroke:none"/>',
+            '<path d="M 1,2 L 4,2 L 4,2 L 7,2 L 1,5 Z"'
+            ' style="fill:#0000ff;stroke:#000000;stroke-width:1"/>',
+            '<path d="M 1,2 L 3.333,4.333 L 5,6"'
+            ' style="fill:none;stroke:#ff00ff;stroke-width:1"/>',
+            '<path d="M 0,0 C 10,0 10,10 0,10 Z" style="fill:#ffff00"/>',
+            '<path d="M 0,0 Q 5,10 10,0"'
+            ' style="fill:none;stroke:#000000;stroke-width:2"/>',
+            '<path sodipodi:type="arc" sodipodi:cx="1" sodipodi:cy="2"'
+            ' sodipodi:rx="3" sodipodi:ry="4" sodipodi:start="0"'
+            ' sodipodi:end="3" d="M 4,2 A 3,4 0 1 1 -1.97,2.56"'
+            ' style="fill:#00ffff"/>',
+            '<text x="1" y="2" style="font-size:4px"><tspan>Foo</tspan></text>'
+        ]
+        # 9 groups of 8 shapes, the groups alone are too small for a batch
+        groups = [
+            "".join(
+                '<g transform="rotate({}) translate(5,2)">{}</g>'.format(i, s)
+                for s in shapes
+            )
+            for i in range(0, 100, 12)
+        ]
+
+        def convert(name, content, options):
+            fsvg = pathlib.Path(tmpdir) / (name + ".svg")
+            with io.open(str(fsvg), "wb") as f:
+                f.write((
+                    '<svg xmlns="http://www.w3.org/2000/svg"'
+                    ' xmlns:sodipodi="http://sodipodi.sourceforge.net/'
+                    'DTD/sodipodi-0.dtd" width="100" height="100">'
+                    + content + '</svg>'
+                ).encode("utf-8"))
+            res = subprocess.check_output(
+                ["python", "src/svg2modelica.py", "--strict=true"] + options
+                + [str(fsvg)]
+            ).decode("utf-8")
+            return re.findall(r"\n {16}([A-Z]\w*\(.*?\n {16}\))", res, re.S)
+
+        try:
+            for options in [[], ["-n", "true"]]:
+                batch = convert("batch", "".join(groups), options)
+                n = len(shapes)
+                self.assertEqual(len(groups) * n, len(batch))
+                for i, g in enumerate(groups):
+                    single = convert("single", g, options)
+                    self.assertEqual(single, batch[i*n:(i+1)*n])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_parallel(self):
+        # enough elements for several chunks of a parallel conversion
+        tmpdir = tempfile.mkdtemp()
+        try:
+            shapes = "".join(
+                '<g transform="rotate({0})"><rect x="{0}" y="1" width="3"'
+                ' height="2" style="fill:#ff0000;stroke:none"/>'
+                '<path d="M {0},1 C 3,0 5,2 {0},4 Z" style="fill:#00ff00"/>'
+                '<text x="{0}" y="2" style="font-size:4px"><tspan>Foo</tspan>'
+                '</text></g>'.format(i)
+                for i in range(300)
+            )
+            fsvg = pathlib.Path(tmpdir) / "parallel.svg"
+            with io.open(str(fsvg), "wb") as f:
+                f.write((
+                    '<svg xmlns="http://www.w3.org/2000/svg" width="100"'
+                    ' height="100">' + shapes + '</svg>'
+                ).encode("utf-8"))
+            cmd = ["python", "src/svg2modelica.py", "--strict=true"]
+            for options in [[], ["-n", "true"]]:
+                exp = subprocess.check_output(cmd + options + [str(fsvg)])
+                act = subprocess.check_output(
+                    cmd + options + ["--jobs=2", str(fsvg)]
+                )
+                self.assertEqual(exp, act)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_cache(self):
+        cachedir = tempfile.mkdtemp()
+        try:
+            for _ in range(2):
+                act, exp = self.get_expected_and_actual(
+                    "all_primitives", "--cache_dir=" + cachedir
+                )
+                self.assertEqualStdout(exp, act)
+            entries = [
+                f for _, _, fs in os.walk(cachedir) for f in fs
+                if f.endswith(".mo")
+            ]
+            self.assertEqual(1, len(entries))
+            subprocess.check_call([
+                "python", "src/svg2modelica.py", "--cache_dir=" + cachedir,
+                "--clear_cache=true"
+            ])
+            entries = [f for _, _, fs in os.walk(cachedir) for f in fs]
+            self.assertEqual(0, len(entries))
+        finally:
+            shutil.rmtree(cachedir)
+
+    def test_cache_streaming(self):
+        # streaming skips <use> elements, so its results must not be reused
+        # for conversions without streaming
+        cachedir = tempfile.mkdtemp()
+        try:
+            fsvg = str(pathlib.Path("examples") / "use.svg")
+            cmd = ["python", "src/svg2modelica.py", "--cache_dir=" + cachedir]
+            proc = subprocess.Popen(
+                cmd + ["--streaming=true", fsvg],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            proc.communicate()
+            self.assertEqual(0, proc.returncode)
+            act = subprocess.check_output(cmd + [fsvg])
+            fexp = pathlib.Path("examples") / "use_expected.mo"
+            with io.open(str(fexp), "r", encoding="utf-8") as f:
+                exp = f.read()
+            self.assertEqualStdout(exp, act.decode("utf-8"))
+        finally:
+            shutil.rmtree(cachedir)
+
+    def test_element_cache(self):
+        cachedir = tempfile.mkdtemp()
+        try:
+            self.get_expected_and_actual(
+                "group_transform", "--cache_dir=" + cachedir
+            )
+            # move rectangle, but keep ellipse
+            fsvg = pathlib.Path("examples") / "group_transform.svg"
+            with io.open(str(fsvg), "r", encoding="utf-8") as f:
+                svg = f.read().replace('x="31.097403"', 'x="21.097403"')
+            fmod = pathlib.Path(cachedir) / "group_transform_moved.svg"
+            with io.open(str(fmod), "w", encoding="utf-8") as f:
+                f.write(svg)
+            cmd = ["python", "src/svg2modelica.py", "--strict=true"]
+            exp = subprocess.check_output(cmd + [str(fmod)])
+            act = subprocess.check_output(
+                cmd + ["--cache_dir=" + cachedir, str(fmod)]
+            )
+            self.assertEqualStdout(exp.decode("utf-8"), act.decode("utf-8"))
+            # a malformed element cache is ignored
+            for data in [b"\x80\x03}q\x00.", b"{}", b"[[1, 2]]"]:
+                fcache = pathlib.Path(cachedir) / "elements.json"
+                with io.open(str(fcache), "wb") as f:
+                    f.write(data)
+                act = subprocess.check_output(
+                    cmd + ["--cache_dir=" + cachedir, str(fmod)]
+                )
+                self.assertEqualStdout(
+                    exp.decode("utf-8"), act.decode("utf-8")
+                )
+        finally:
+            shutil.rmtree(cachedir)
+
+    def test_daemon(self):
+        tmpdir = tempfile.mkdtemp()
+        env = dict(os.environ, MONK_SOCKET=os.path.join(tmpdir, "monk.sock"))
+        env.pop("MONK_CACHE_DIR", None)
+        client = [
+            "python", "src/svg2modelica_client.py", "--strict=true",
+            str(pathlib.Path("examples") / "group_transform.svg")
+        ]
+        fexp = pathlib.Path("examples") / "group_transform_expected.mo"
+        with io.open(str(fexp), "r", encoding="utf-8") as f:
+            exp = f.read()
+        daemon = None
+        try:
+            # without a daemon, the client falls back to in-process conversion
+            act = subprocess.check_output(client, env=env)
+            self.assertEqualStdout(exp, act.decode("utf-8"))
+            daemon = subprocess.Popen(
+                ["python", "src/svg2modelica.py", "--daemon=true"], env=env
+            )
+            for _ in range(100):
+                if os.path.exists(env["MONK_SOCKET"]):
+                    break
+                time.sleep(0.05)
+            # the socket is only accessible by its owner
+            self.assertEqual(0, os.stat(env["MONK_SOCKET"]).st_mode & 0o077)
+            act = subprocess.check_output(client, env=env)
+            self.assertEqualStdout(exp, act.decode("utf-8"))
+            # the daemon uses the cache directory of the client
+            cachedir = os.path.join(tmpdir, "cache")
+            act = subprocess.check_output(
+                client, env=dict(env, MONK_CACHE_DIR=cachedir)
+            )
+            self.assertEqualStdout(exp, act.decode("utf-8"))
+            entries = [
+                f for _, _, fs in os.walk(cachedir) for f in fs
+                if f.endswith(".mo")
+            ]
+            self.assertEqual(1, len(entries))
+        finally:
+            if daemon is not None:
+                daemon.terminate()
+                daemon.wait()
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == "__main__":
     os.chdir(str(pathlib.Path(__file__).parents[1]))